@@ -42,6 +42,10 @@ print('--------------------- Elfin UI Addon import/reload')
 modules_to_import = [
     'addon_paths',
     'debug',
+    'xdb_index',
+    'kinematics',
+    'collision_numpy',
+    'collision',
     'livebuild_helper',
     'livebuild',
     'obj_processing',
@@ -95,6 +99,13 @@ def add_watcher(scene):
     mlw_handler_list.append(mod_life_watcher)
 
 
+@persistent
+def invalidate_indices(scene):
+    """Undo and redo restore Blender data behind the addon's back."""
+    collision.module_index.mark_dirty()
+    livebuild_helper.NetworkIndex().mark_dirty()
+
+
 def watch_movement(scene):
     # obj = bpy.context.active_object
     # if obj and obj.is_updated:
@@ -126,6 +137,10 @@ def register():
                             add_watcher)
     remove_then_add_handler(bpy.app.handlers.scene_update_pre,
                             watch_movement)
+    remove_then_add_handler(bpy.app.handlers.undo_post,
+                            invalidate_indices)
+    remove_then_add_handler(bpy.app.handlers.redo_post,
+                            invalidate_indices)
 
     # Watcher needs to be hooked up in register() as well, because on addon
     # reload the load_pre and load_post handlers won't get called.
@@ -134,6 +149,9 @@ def register():
 
     bpy.types.INFO_MT_add.append(livebuild_helper.module_menu)
 
+    # Resources are otherwise loaded on first use.
+    livebuild_helper.LivebuildState().warm_up()
+
     print('--------------------- Elfin Front Addon registered')
 
 
@@ -158,6 +176,10 @@ def unregister():
                    add_watcher)
     remove_handler(bpy.app.handlers.scene_update_pre,
                    watch_movement)
+    remove_handler(bpy.app.handlers.undo_post,
+                   invalidate_indices)
+    remove_handler(bpy.app.handlers.redo_post,
+                   invalidate_indices)
 
     bpy.types.INFO_MT_add.remove(livebuild_helper.module_menu)
 
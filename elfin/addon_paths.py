@@ -12,3 +12,4 @@ elfin_root = make_path(addon_root, 'elfin')
 pguide_path = make_path(elfin_root, 'pguide.blend')
 modlib_path = make_path(elfin_root, 'library.blend')
 xdb_path = make_path(elfin_root, 'xdb.json')
+xdb_cache_path = make_path(elfin_root, 'xdb.cache')
@@ -0,0 +1,452 @@
+import math
+
+import bpy
+import mathutils
+import mathutils.bvhtree
+import numpy as np
+
+from . import collision_numpy
+
+# Global (Const) Variables -----------------------
+
+# Meshes are shrunk about their origin before testing because single module
+# 3D models are not very accurate at the interfaces.
+default_scale_factor = 0.90
+
+# Narrow phase used by objects_overlap(): 'bvh' (mathutils.bvhtree) or
+# 'numpy' (collision_numpy, which also runs without Blender).
+backends = ('bvh', 'numpy')
+backend = 'bvh'
+
+# Classes ----------------------------------------
+
+
+class PrototypeGeometry(object):
+    """Local-space collision geometry of one prototype mesh, shrunk by
+    scale_factor about the object origin.
+    """
+
+    def __init__(self, arrays, scale_factor):
+        self.verts = arrays.verts * scale_factor
+        self.polys = arrays.tris.tolist()
+        self.tree = mathutils.bvhtree.BVHTree.FromPolygons(
+            self.verts.tolist(), self.polys)
+        self.center = mathutils.Vector(arrays.center * scale_factor)
+        self.radius = arrays.radius * scale_factor
+
+    def transformed_tree(self, tx):
+        """Builds a BVH of this geometry transformed by tx."""
+        tx = np.array(tx)
+        verts = self.verts.dot(tx[:3, :3].T) + tx[:3, 3]
+        return mathutils.bvhtree.BVHTree.FromPolygons(
+            verts.tolist(), self.polys)
+
+
+class SphereGrid(object):
+    """Uniform grid of bounding spheres for broad-phase culling.
+
+    Each sphere is registered in every cell its bounding box touches, so
+    any cell_size is correct; about one sphere diameter is efficient.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = max(cell_size, 1e-6)
+        self.cells = {}
+        self.spheres = {}  # key -> (center, radius, cells)
+
+    def __len__(self):
+        return len(self.spheres)
+
+    def __contains__(self, key):
+        return key in self.spheres
+
+    def cell_range(self, center, radius):
+        lo = [int(math.floor((c - radius) / self.cell_size)) for c in center]
+        hi = [int(math.floor((c + radius) / self.cell_size)) for c in center]
+        return [(x, y, z)
+                for x in range(lo[0], hi[0] + 1)
+                for y in range(lo[1], hi[1] + 1)
+                for z in range(lo[2], hi[2] + 1)]
+
+    def insert(self, key, center, radius):
+        if key in self.spheres:
+            self.remove(key)
+        cells = self.cell_range(center, radius)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(key)
+        self.spheres[key] = (mathutils.Vector(center), radius, cells)
+
+    def remove(self, key):
+        _, _, cells = self.spheres.pop(key, (None, None, ()))
+        for cell in cells:
+            bucket = self.cells[cell]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def query(self, center, radius):
+        """Returns keys of spheres that overlap the given sphere."""
+        center = mathutils.Vector(center)
+        seen = set()
+        hits = []
+        for cell in self.cell_range(center, radius):
+            for key in self.cells.get(cell, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                other_center, other_radius, _ = self.spheres[key]
+                if (other_center - center).length <= radius + other_radius:
+                    hits.append(key)
+        return hits
+
+
+class ModuleSpatialIndex(object):
+    """Persistent broad-phase index of placed module bounds.
+
+    Bounding spheres are stored per network, in the network parent's local
+    frame. Modules are locked to their network parent, so moving a network
+    does not invalidate the index; only reparenting needs update().
+    Entries are kept by name and networks are looked up on each query,
+    because undo and file loads free Blender data.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.grids = {}  # network name ('' if none) -> SphereGrid
+        self.networks = {}  # module name -> network name
+        self.dirty = False
+
+    def mark_dirty(self):
+        """Requests a rebuild before the next query, e.g. after undo."""
+        self.dirty = True
+
+    def rebuild(self, scene):
+        self.clear()
+        for ob in scene.objects:
+            if ob.elfin.is_module():
+                self.insert(ob)
+
+    def insert(self, obj, scale_factor=default_scale_factor):
+        self.remove(obj.name)
+
+        # Relative to the network the sphere only depends on obj's own
+        # transform, so it is valid even before the scene is updated.
+        network = obj.parent
+        nw_name = network.name if network else ''
+        local = obj.matrix_parent_inverse * obj.matrix_basis \
+            if network else obj.matrix_basis
+        center, radius = bounding_sphere(obj, scale_factor, local)
+
+        grid = self.grids.get(nw_name)
+        if grid is None:
+            grid = self.grids[nw_name] = SphereGrid(2 * radius)
+        grid.insert(obj.name, center, radius)
+        self.networks[obj.name] = nw_name
+
+    def update(self, obj):
+        """Re-indexes obj if it is indexed, e.g. after a reparent."""
+        if obj.name in self.networks:
+            self.insert(obj)
+
+    def remove(self, name):
+        nw_name = self.networks.pop(name, None)
+        if nw_name is None:
+            return
+        grid = self.grids[nw_name]
+        grid.remove(name)
+        if not grid:
+            del self.grids[nw_name]
+
+    def query(self, obj, scale_factor=default_scale_factor):
+        """Returns indexed modules whose bounds overlap obj's."""
+        if self.dirty or any(nw_name and nw_name not in bpy.data.objects
+                             for nw_name in self.grids):
+            # Networks renamed or removed behind our back
+            self.rebuild(bpy.context.scene)
+
+        center, radius = bounding_sphere(obj, scale_factor)
+        hits = []
+        for nw_name, grid in self.grids.items():
+            network = bpy.data.objects[nw_name] if nw_name else None
+            for name in grid.query(
+                    *to_network_frame(network, center, radius)):
+                ob = bpy.data.objects.get(name)
+                if ob is not None and name != obj.name:
+                    hits.append(ob)
+        return hits
+
+
+class PairResultCache(object):
+    """Narrow-phase results between module networks.
+
+    Results are kept per pair of networks, together with a fingerprint of
+    each network: its matrix_world and its members with their local
+    matrices. Modules are locked to their network, so results stay valid
+    until either network is moved or changes members or arrangement, at
+    which point the entry is dropped. Results within a single network do
+    not depend on the network's own transform.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # (nw_name_a, nw_name_b, scale_factor, backend) ->
+        #   (fingerprints, {frozenset name pair: overlaps})
+        self.entries = {}
+
+    @staticmethod
+    def fingerprint(network, with_transform=True):
+        # Freed names get reused, so members are identified together with
+        # their placement in the network.
+        members = frozenset(
+            (c.name, c.elfin.module_name,
+             tuple(tuple(row)
+                   for row in c.matrix_parent_inverse * c.matrix_basis))
+            for c in network.children)
+        if not with_transform:
+            return members
+        return tuple(tuple(row) for row in network.matrix_world), members
+
+    def results_for(self, nw_a, nw_b, scale_factor, fingerprints):
+        """Returns the mutable result dict for a network pair, emptied if
+        either network changed. fingerprints memoizes per check.
+        """
+        nw_a, nw_b = sorted((nw_a, nw_b), key=lambda nw: nw.name)
+        key = (nw_a.name, nw_b.name, scale_factor, backend)
+        with_transform = nw_a != nw_b
+
+        fps = []
+        for nw in (nw_a, nw_b):
+            fp_key = (nw.name, with_transform)
+            if fp_key not in fingerprints:
+                fingerprints[fp_key] = self.fingerprint(nw, with_transform)
+            fps.append(fingerprints[fp_key])
+        fps = tuple(fps)
+
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != fps:
+            entry = self.entries[key] = (fps, {})
+        return entry[1]
+
+    def prune(self):
+        """Drops entries of networks that no longer exist."""
+        objects = bpy.data.objects
+        for key in [k for k in self.entries
+                    if k[0] not in objects or k[1] not in objects]:
+            del self.entries[key]
+
+# Geometry cache ---------------------------------
+
+# prototype key -> collision_numpy.MeshArrays
+mesh_cache = {}
+
+# (prototype key, scale_factor) -> PrototypeGeometry
+geometry_cache = {}
+
+
+def prototype_key(obj):
+    """Modules of the same prototype share geometry even if they don't share
+    a mesh (e.g. in files created before prototype pooling).
+    """
+    if obj.elfin.is_module():
+        return 'module', obj.elfin.module_name
+    return 'mesh', obj.data.name
+
+
+def extract_mesh_arrays(obj):
+    """Copies obj's mesh into NumPy arrays in a few foreach_get calls."""
+    mesh = obj.data
+    verts = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts)
+
+    n_polys = len(mesh.polygons)
+    loop_starts = np.empty(n_polys, dtype=np.int32)
+    loop_totals = np.empty(n_polys, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_start', loop_starts)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_verts)
+
+    return collision_numpy.MeshArrays.from_polygons(
+        verts, loop_starts, loop_totals, loop_verts,
+        scale=obj.matrix_world.to_scale())
+
+
+def get_mesh_arrays(obj, key=None):
+    """Returns the cached MeshArrays of obj's prototype. key overrides
+    prototype_key(obj), e.g. for library prototypes that are not modules.
+    """
+    key = key or prototype_key(obj)
+    arrays = mesh_cache.get(key)
+    if arrays is None:
+        arrays = mesh_cache[key] = extract_mesh_arrays(obj)
+    return arrays
+
+
+def get_geometry(obj, scale_factor):
+    key = (prototype_key(obj), scale_factor)
+    geometry = geometry_cache.get(key)
+    if geometry is None:
+        geometry = geometry_cache[key] = \
+            PrototypeGeometry(get_mesh_arrays(obj), scale_factor)
+    return geometry
+
+
+def world_tree(obj, scale_factor, trees):
+    """Returns the BVH of obj's shrunk mesh in world space, built at most
+    once per trees dict for each placement of obj.
+    """
+    mw = obj.matrix_world
+    key = (obj.name, scale_factor, tuple(tuple(row) for row in mw))
+    tree = trees.get(key)
+    if tree is None:
+        tree = trees[key] = \
+            get_geometry(obj, scale_factor).transformed_tree(mw)
+    return tree
+
+
+def clear_geometry_cache():
+    mesh_cache.clear()
+    geometry_cache.clear()
+    pair_cache.clear()
+
+
+def bounding_sphere(obj, scale_factor=default_scale_factor, matrix=None):
+    """Returns the world-space (center, radius) enclosing obj's shrunk mesh,
+    or the one in the frame of matrix if given.
+    """
+    geometry = get_geometry(obj, scale_factor)
+    mw = obj.matrix_world if matrix is None else matrix
+    return mw * geometry.center, \
+        geometry.radius * max(abs(s) for s in mw.to_scale())
+
+
+def to_network_frame(network, center, radius):
+    """Converts a world-space sphere into network's local frame."""
+    if network is None:
+        return center, radius
+    mw = network.matrix_world
+    min_scale = max(min(abs(s) for s in mw.to_scale()), 1e-9)
+    return mw.inverted() * center, radius / min_scale
+
+# Queries ----------------------------------------
+
+
+def find_candidates(subjects, objs, scale_factor=default_scale_factor):
+    """Broad phase: maps each subject to the objects in objs whose bounding
+    spheres overlap its own. Subjects are never their own candidates.
+    """
+    objs = list(objs)
+    spheres = {ob.name: bounding_sphere(ob, scale_factor) for ob in objs}
+    by_name = {ob.name: ob for ob in objs}
+
+    max_radius = max((r for _, r in spheres.values()), default=0.0)
+    grid = SphereGrid(2 * max_radius)
+    for name, (center, radius) in spheres.items():
+        grid.insert(name, center, radius)
+
+    candidates = {}
+    for sub in subjects:
+        center, radius = spheres.get(sub.name) or \
+            bounding_sphere(sub, scale_factor)
+        candidates[sub] = [by_name[name]
+                           for name in grid.query(center, radius)
+                           if name != sub.name]
+    return candidates
+
+
+def linked_pairs(mods):
+    """Returns the unordered name pairs of modules that are linked."""
+    pairs = set()
+    for mod in mods:
+        for linkage in (mod.elfin.n_linkage, mod.elfin.c_linkage):
+            for link in linkage:
+                if link.target_mod:
+                    pairs.add(frozenset((mod.name, link.target_mod.name)))
+    return pairs
+
+
+def find_collisions(
+        candidates,
+        scale_factor=default_scale_factor,
+        trees=None):
+    """Narrow phase over broad-phase candidates, i.e. {subject: [objs]}.
+
+    Each unordered pair is tested at most once. Pairs of an object with
+    itself and of linked neighbours are skipped. Results between networked
+    modules are reused from pair_cache while their networks are unchanged.
+    trees optionally shares world-space BVHs across calls, see
+    objects_overlap().
+
+    Returns:
+     - a symmetric map {obj: [colliding objs]} with an entry for every
+       subject and every object that collides with one.
+    """
+    linked = linked_pairs(candidates)
+    collision_map = {sub: [] for sub in candidates}
+    tested = set()
+    fingerprints = {}
+    if trees is None:
+        trees = {}
+    pair_cache.prune()
+
+    for sub, objs in candidates.items():
+        for ob in objs:
+            pair = frozenset((sub.name, ob.name))
+            if len(pair) < 2 or pair in tested or pair in linked:
+                continue
+            tested.add(pair)
+
+            results = None
+            if sub.parent and ob.parent:
+                results = pair_cache.results_for(
+                    sub.parent, ob.parent, scale_factor, fingerprints)
+
+            overlaps = results.get(pair) if results is not None else None
+            if overlaps is None:
+                overlaps = objects_overlap(sub, ob, scale_factor, trees)
+                if results is not None:
+                    results[pair] = overlaps
+
+            if overlaps:
+                collision_map[sub].append(ob)
+                collision_map.setdefault(ob, []).append(sub)
+
+    return collision_map
+
+
+def objects_overlap(obj_a, obj_b, scale_factor, trees=None):
+    """Tests whether the shrunk meshes of two objects overlap in world space,
+    using the narrow phase selected by backend.
+
+    With the BVH backend, pass the same trees dict to every call of a check
+    so that each object's world-space tree is built only once. Without it,
+    only obj_a's geometry is re-triangulated: it is brought into obj_b's
+    local frame so that obj_b's cached tree can be used as is.
+    """
+    if backend == 'numpy':
+        return collision_numpy.meshes_overlap(
+            get_mesh_arrays(obj_a), np.array(obj_a.matrix_world),
+            get_mesh_arrays(obj_b), np.array(obj_b.matrix_world),
+            scale_factor)
+
+    if trees is not None:
+        return len(world_tree(obj_a, scale_factor, trees).overlap(
+            world_tree(obj_b, scale_factor, trees))) > 0
+
+    geom_a = get_geometry(obj_a, scale_factor)
+    geom_b = get_geometry(obj_b, scale_factor)
+
+    tx = obj_b.matrix_world.inverted() * obj_a.matrix_world
+    return len(geom_b.tree.overlap(geom_a.transformed_tree(tx))) > 0
+
+# Shared state -----------------------------------
+
+# Kept up to date by ModuleLifetimeWatcher as modules enter and exit.
+module_index = ModuleSpatialIndex()
+
+pair_cache = PairResultCache()
@@ -0,0 +1,363 @@
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+try:
+    from . import xdb_index
+except ImportError:
+    # Imported headless with elfin/ on sys.path: the elfin package itself
+    # needs bpy.
+    import xdb_index
+
+# Global (Const) Variables -----------------------
+
+# Upper bound of triangle pairs compared at once, to bound memory use.
+max_batch_pairs = 1 << 18
+
+# Below this many candidate pairs a process pool costs more than it saves.
+min_parallel_pairs = 64
+
+# (meshes, transforms, scale_factor) inherited by forked pool workers, so
+# that mesh arrays are not pickled for every task.
+worker_state = None
+
+# Classes ----------------------------------------
+
+
+class MeshArrays(object):
+    """Triangulated local-space mesh of one prototype.
+
+     - verts: (V, 3) float64 vertex coordinates.
+     - tris: (T, 3) vertex indices.
+     - scale: (3,) the prototype object's own scale. Needed to place the
+       mesh from an exported rot/tran pair, which has scale removed.
+    """
+
+    def __init__(self, verts, tris, scale=(1.0, 1.0, 1.0)):
+        self.verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+        self.tris = np.asarray(tris, dtype=np.int64).reshape(-1, 3)
+        self.scale = np.asarray(scale, dtype=np.float64).reshape(3)
+
+        if len(self.verts):
+            lo, hi = self.verts.min(axis=0), self.verts.max(axis=0)
+            self.center = (lo + hi) / 2
+            self.radius = float(
+                np.linalg.norm(self.verts - self.center, axis=1).max())
+        else:
+            self.center = np.zeros(3)
+            self.radius = 0.0
+
+    @classmethod
+    def from_polygons(cls, verts, loop_starts, loop_totals, loop_verts,
+                      scale=(1.0, 1.0, 1.0)):
+        """Fan-triangulates polygons given in Blender's flat loop layout."""
+        loop_starts = np.asarray(loop_starts, dtype=np.int64)
+        loop_verts = np.asarray(loop_verts, dtype=np.int64)
+        tris_per_poly = np.asarray(loop_totals, dtype=np.int64) - 2
+
+        poly_of_tri = np.repeat(np.arange(len(tris_per_poly)), tris_per_poly)
+        first_tri = np.cumsum(tris_per_poly) - tris_per_poly
+        fan_idx = np.arange(tris_per_poly.sum()) - \
+            np.repeat(first_tri, tris_per_poly)
+
+        a = loop_starts[poly_of_tri]
+        b = a + fan_idx + 1
+        tris = loop_verts[np.stack([a, b, b + 1], axis=1)]
+        return cls(verts, tris, scale)
+
+    def world_triangles(self, tx):
+        """Returns (T, 3, 3) triangle vertices transformed by (4, 4) tx."""
+        verts = self.verts.dot(tx[:3, :3].T) + tx[:3, 3]
+        return verts[self.tris]
+
+# Helpers ----------------------------------------
+
+
+def shrink(tx, scale_factor):
+    """Applies a uniform shrink about the object origin, like
+    matrix_world * Matrix.Scale(scale_factor, 4).
+    """
+    shrunk = np.array(tx, dtype=np.float64)
+    shrunk[:3, :3] *= scale_factor
+    return shrunk
+
+
+def node_transform(rot, tran, scale):
+    """Builds a world transform from an exported rot/tran pair (pymol
+    units) and the prototype object's own scale.
+    """
+    tx = np.eye(4)
+    tx[:3, :3] = np.asarray(rot, dtype=np.float64) * scale
+    tx[:3, 3] = np.asarray(tran, dtype=np.float64) / \
+        xdb_index.blender_pymol_unit_conversion
+    return tx
+
+
+def bounding_sphere(mesh, tx):
+    """Returns the (center, radius) enclosing mesh transformed by tx."""
+    center = tx[:3, :3].dot(mesh.center) + tx[:3, 3]
+    radius = mesh.radius * np.linalg.norm(tx[:3, :3], axis=0).max()
+    return center, radius
+
+
+def triangles_intersect(tri_a, tri_b):
+    """Separating axis test of triangle pairs.
+
+    Args:
+     - tri_a, tri_b: (K, 3, 3) arrays; row k of each forms a pair.
+
+    Returns:
+     - (K,) bool array, True where the pair intersects or touches.
+    """
+    edge_a = np.roll(tri_a, -1, axis=1) - tri_a
+    edge_b = np.roll(tri_b, -1, axis=1) - tri_b
+    normal_a = np.cross(edge_a[:, 0], edge_a[:, 1])
+    normal_b = np.cross(edge_b[:, 0], edge_b[:, 1])
+
+    # Face normals, edge-edge crosses, and in-plane edge normals for the
+    # coplanar case: 2 + 9 + 6 candidate axes.
+    axes = [normal_a, normal_b]
+    axes += [np.cross(edge_a[:, i], edge_b[:, j])
+             for i in range(3) for j in range(3)]
+    axes += [np.cross(normal_a, edge_a[:, i]) for i in range(3)]
+    axes += [np.cross(normal_b, edge_b[:, i]) for i in range(3)]
+    axes = np.stack(axes, axis=1)  # (K, 17, 3)
+
+    proj_a = np.einsum('kxd,kvd->kxv', axes, tri_a)
+    proj_b = np.einsum('kxd,kvd->kxv', axes, tri_b)
+    separated = (proj_a.max(axis=2) < proj_b.min(axis=2)) | \
+        (proj_b.max(axis=2) < proj_a.min(axis=2))
+
+    # Near-degenerate axes (parallel edges) carry only rounding noise.
+    extent = np.abs(np.concatenate([tri_a, tri_b], axis=1)).max(axis=(1, 2))
+    axis_len2 = (axes ** 2).sum(axis=2)
+    valid = axis_len2 > (1e-12 * extent[:, None] ** 2) ** 2
+    return ~(separated & valid).any(axis=1)
+
+
+def triangle_sets_overlap(tris_a, tris_b):
+    """Tests whether any triangle of tris_a intersects any of tris_b."""
+    if not len(tris_a) or not len(tris_b):
+        return False
+
+    lo_a, hi_a = tris_a.min(axis=1), tris_a.max(axis=1)
+    lo_b, hi_b = tris_b.min(axis=1), tris_b.max(axis=1)
+
+    # Only keep triangles inside the other set's bounding box.
+    keep_a = np.all((lo_a <= hi_b.max(axis=0)) &
+                    (hi_a >= lo_b.min(axis=0)), axis=1)
+    keep_b = np.all((lo_b <= hi_a.max(axis=0)) &
+                    (hi_b >= lo_a.min(axis=0)), axis=1)
+    tris_a, lo_a, hi_a = tris_a[keep_a], lo_a[keep_a], hi_a[keep_a]
+    tris_b, lo_b, hi_b = tris_b[keep_b], lo_b[keep_b], hi_b[keep_b]
+    if not len(tris_a) or not len(tris_b):
+        return False
+
+    batch = max(1, max_batch_pairs // len(tris_b))
+    for start in range(0, len(tris_a), batch):
+        end = start + batch
+        box_hits = np.all(
+            (lo_a[start:end, None] <= hi_b[None]) &
+            (hi_a[start:end, None] >= lo_b[None]), axis=2)
+        ia, ib = np.nonzero(box_hits)
+        if len(ia) and triangles_intersect(
+                tris_a[start + ia], tris_b[ib]).any():
+            return True
+
+    return False
+
+
+def meshes_overlap(mesh_a, tx_a, mesh_b, tx_b,
+                   scale_factor=1.0):
+    """Tests whether two placed meshes overlap after shrinking each about
+    its origin by scale_factor.
+    """
+    tx_a, tx_b = shrink(tx_a, scale_factor), shrink(tx_b, scale_factor)
+
+    center_a, radius_a = bounding_sphere(mesh_a, tx_a)
+    center_b, radius_b = bounding_sphere(mesh_b, tx_b)
+    if np.linalg.norm(center_a - center_b) > radius_a + radius_b:
+        return False
+
+    return triangle_sets_overlap(mesh_a.world_triangles(tx_a),
+                                 mesh_b.world_triangles(tx_b))
+
+
+def candidate_pairs(centers, radii):
+    """Sweep-and-prune broad phase over bounding spheres.
+
+    Returns:
+     - list of (i, j) index pairs, i < j, whose spheres overlap.
+    """
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    radii = np.asarray(radii, dtype=np.float64)
+    order = np.argsort(centers[:, 0] - radii)
+    lo_x = (centers[:, 0] - radii)[order]
+    hi_x = (centers[:, 0] + radii)[order]
+
+    pairs = []
+    for k in range(len(order)):
+        # Everything sorted after k that starts before k ends
+        end = np.searchsorted(lo_x, hi_x[k], side='right')
+        if end <= k + 1:
+            continue
+        others = order[k + 1:end]
+        i = order[k]
+        dist = np.linalg.norm(centers[others] - centers[i], axis=1)
+        for j in others[dist <= radii[others] + radii[i]]:
+            pairs.append((int(min(i, j)), int(max(i, j))))
+    return pairs
+
+
+def test_pairs(pairs, meshes, transforms, scale_factor=1.0):
+    """Narrow phase over index pairs.
+
+    Args:
+     - pairs: iterable of (i, j) node indices.
+     - meshes: list of MeshArrays, one per node.
+     - transforms: list of (4, 4) world transforms, one per node.
+
+    Returns:
+     - list of the colliding (i, j) pairs.
+    """
+    return [(i, j) for i, j in pairs
+            if meshes_overlap(meshes[i], transforms[i],
+                              meshes[j], transforms[j], scale_factor)]
+
+
+def test_pairs_worker(pairs):
+    meshes, transforms, scale_factor = worker_state
+    return test_pairs(pairs, meshes, transforms, scale_factor)
+
+
+def can_fork_workers():
+    """Whether a forked process pool is safe here.
+
+    Fork must be available, and we must not be inside Blender's UI: a
+    forked child would inherit its GL context and Python state. Plain
+    Python and background Blender (blender -b) are fine. Spawning is not an
+    alternative because in Blender sys.executable starts another Blender.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return False
+    bpy = sys.modules.get('bpy')
+    return bpy is None or bpy.app.background
+
+
+def test_pairs_parallel(pairs, meshes, transforms, scale_factor=1.0,
+                        processes=None):
+    """Like test_pairs(), but spreads the pairs across a process pool.
+
+    Workers are forked so that they inherit the mesh arrays instead of
+    receiving them pickled. Where that is not safe (see
+    can_fork_workers()) or there are too few pairs, this runs serially.
+
+    Args:
+     - processes: pool size; defaults to the number of CPUs.
+    """
+    global worker_state
+
+    pairs = list(pairs)
+    processes = processes or os.cpu_count() or 1
+    if processes < 2 or len(pairs) < min_parallel_pairs or \
+            not can_fork_workers():
+        return test_pairs(pairs, meshes, transforms, scale_factor)
+
+    # Interleave so that dense regions are shared between workers
+    n_chunks = processes * 4
+    chunks = [pairs[i::n_chunks] for i in range(n_chunks)]
+
+    worker_state = (meshes, transforms, scale_factor)
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            results = pool.map(test_pairs_worker, chunks)
+    finally:
+        worker_state = None
+
+    return [pair for chunk in results for pair in chunk]
+
+
+def find_collisions(names, meshes, transforms, linked=(), scale_factor=1.0,
+                    processes=1):
+    """Collision map of placed meshes, without any Blender objects.
+
+    Args:
+     - names: node names.
+     - meshes, transforms: as in test_pairs().
+     - linked: set of frozenset name pairs to skip (linked neighbours).
+     - processes: pool size for test_pairs_parallel(); 1 runs serially and
+       None uses all CPUs.
+
+    Returns:
+     - symmetric map {name: [colliding names]} with an entry per node.
+    """
+    spheres = [bounding_sphere(m, shrink(tx, scale_factor))
+               for m, tx in zip(meshes, transforms)]
+    pairs = [(i, j) for i, j in candidate_pairs(
+             [c for c, _ in spheres], [r for _, r in spheres])
+             if frozenset((names[i], names[j])) not in linked]
+
+    if processes == 1:
+        colliding = test_pairs(pairs, meshes, transforms, scale_factor)
+    else:
+        colliding = test_pairs_parallel(pairs, meshes, transforms,
+                                        scale_factor, processes)
+
+    collision_map = {name: [] for name in names}
+    for i, j in colliding:
+        collision_map[names[i]].append(names[j])
+        collision_map[names[j]].append(names[i])
+    return collision_map
+
+# Exported designs -------------------------------
+
+
+def find_design_collisions(design, meshes, scale_factor=1.0, processes=1):
+    """Collision map of an exported design, i.e. ExportOperator output.
+
+    Modules are placed from their exported rot/tran, so no Blender scene is
+    needed; linked neighbours are skipped like in the live check.
+
+    Args:
+     - design: exported design dictionary.
+     - meshes: {module_name: MeshArrays}, e.g. from load_meshes().
+     - processes: as in find_collisions().
+
+    Returns:
+     - symmetric map {module object name: [colliding names]}.
+    """
+    names, node_meshes, transforms, linked = [], [], [], set()
+    for network in design['networks'].values():
+        for name, mod in network.items():
+            mesh = meshes[mod['module_name']]
+            names.append(name)
+            node_meshes.append(mesh)
+            transforms.append(
+                node_transform(mod['rot'], mod['tran'], mesh.scale))
+            for link in mod['n_linkage'] + mod['c_linkage']:
+                linked.add(frozenset((name, link['target_mod'])))
+
+    return find_collisions(names, node_meshes, transforms,
+                           linked, scale_factor, processes)
+
+
+def save_meshes(path, meshes):
+    """Writes {name: MeshArrays} to an .npz file for headless use."""
+    arrays = {}
+    for name, mesh in meshes.items():
+        arrays[name + '.verts'] = mesh.verts
+        arrays[name + '.tris'] = mesh.tris
+        arrays[name + '.scale'] = mesh.scale
+    np.savez_compressed(path, **arrays)
+
+
+def load_meshes(path):
+    """Reads {name: MeshArrays} written by save_meshes()."""
+    with np.load(path) as data:
+        names = {key.rsplit('.', 1)[0] for key in data.files}
+        return {name: MeshArrays(data[name + '.verts'],
+                                 data[name + '.tris'],
+                                 data[name + '.scale'])
+                for name in names}
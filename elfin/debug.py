@@ -21,6 +21,7 @@ class DebugPanel(bpy.types.Panel):
         col.operator('elfin.load_all_obj_files', text='Load all obj files')
         col.operator('elfin.process_obj', text='Process obj file (selection)')
         col.operator('elfin.batch_process', text='Batch process all obj files')
+        col.operator('elfin.print_watcher_stats', text='Print watcher stats')
 
 
 # Operators --------------------------------------
@@ -43,6 +44,21 @@ class DebugPanel(bpy.types.Panel):
 #     def poll(cls, context):
 #         return len(context.selected_objects) > 0
 
+
+class PrintWatcherStatsOperator(bpy.types.Operator):
+    bl_idname = 'elfin.print_watcher_stats'
+    bl_label = 'Print module lifetime watcher tick costs'
+
+    def execute(self, context):
+        for handler in bpy.app.handlers.scene_update_post:
+            stats = getattr(handler, 'tick_stats', None)
+            if stats is not None:
+                print('Watcher ({} objects): {}'.format(
+                    len(context.scene.objects), stats))
+                stats.reset()
+        return {'FINISHED'}
+
+
 class ResetOperator(bpy.types.Operator):
     bl_idname = 'elfin.reset'
     bl_label = 'Reset Elfin UI properties'
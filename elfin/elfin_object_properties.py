@@ -1,11 +1,12 @@
 import enum
 import collections
 
-import inspect
+import sys
 
 import bpy
 import mathutils
 from . import livebuild_helper as lh
+from . import xdb_index
 
 ElfinObjType = \
     enum.Enum('ElfinObjType', 'NONE MODULE JOINT BRIDGE NETWORK PG_NETWORK')
@@ -40,6 +41,7 @@ class Link(bpy.types.PropertyGroup):
             print('Severing: ', repr(self))
 
             tl.remove(tl.find(self.target_chain_id))
+            lh.NetworkIndex().unlink(self.id_data, self.target_mod)
 
 
 class ObjectPointerWrapper(bpy.types.PropertyGroup):
@@ -58,7 +60,6 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
     pg_neighbors = bpy.props.CollectionProperty(type=ObjectPointerWrapper)
     tx_tol = bpy.props.FloatProperty(min=0.0, default=0.0)
 
-    node_walked = bpy.props.BoolProperty(default=False)
     destroy_entered = bpy.props.BoolProperty(default=False)
 
     def get_available_links(self):
@@ -130,7 +131,7 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
         # Must not use direct Vector division by scalar here
         # before Blender's Vector scalar division is less accurate than
         # float division
-        tran = [f * lh.blender_pymol_unit_conversion for f in tran]
+        tran = [f * xdb_index.blender_pymol_unit_conversion for f in tran]
         data['rot'] = list(list(vec) for vec in rot.to_matrix())
         data['tran'] = list(tran)
 
@@ -182,14 +183,15 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
     def is_pg_network(self):
         return self.obj_type == ElfinObjType.PG_NETWORK.value
 
-    def destroy(self):
+    def destroy(self, flush=True):
         """Clean up elfin data of this object, then call delete on the
         associated object.
+
+        Batched callers pass flush=False and call lh.flush_destroyed() once
+        after all their destroy() calls.
         """
 
-        curframe = inspect.currentframe()
-        calframe = inspect.getouterframes(curframe, 2)
-        print('Destroy caller name:', calframe[1][3])
+        print('Destroy caller name:', sys._getframe(1).f_code.co_name)
 
         # Prevent parent calling child destroy infinite loop
         if self.destroy_entered:
@@ -203,7 +205,14 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
             return
 
         print('Enter destroy() of', self.obj_ptr)
-        parent = self.obj_ptr.parent
+        if self.is_network() or self.is_pg_network():
+            lh.destroy_networks([self.obj_ptr], flush=flush)
+            return
+
+        # Cleanup can remove the parent (e.g. an emptied network), so look
+        # it up again by name afterwards.
+        parent_name = self.obj_ptr.parent.name if self.obj_ptr.parent else ''
+        was_module = self.is_module()
 
         if self.is_module():
             self.cleanup_module()
@@ -211,8 +220,6 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
             self.cleanup_joint()
         elif self.is_bridge():
             self.cleanup_bridge()
-        elif self.is_network() or self.is_pg_network():
-            self.cleanup_network()
         else:
             return  # No obj_ptr to delete
 
@@ -220,13 +227,15 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
 
         self.delete_object(self.obj_ptr)
 
+        parent = bpy.data.objects.get(parent_name)
         if parent and \
             (parent.elfin.is_network() or
              parent.elfin.is_pg_network()) and \
                 len(parent.children) == 0:
-            parent.elfin.destroy()
+            parent.elfin.destroy(flush=flush)
 
-        bpy.context.scene.update()  # Flush out dead object
+        if flush:
+            lh.flush_destroyed(reclaim_colors=was_module)
 
     def delete_object(self, obj):
         """
@@ -245,6 +254,7 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
         obj.use_fake_user = False
 
         bpy.ops.object.delete(use_global=False)
+        lh.bump_object_generation()
 
         # if obj and obj.name in bpy.data.objects:
         #     bpy.data.objects.remove(obj)
@@ -254,13 +264,6 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
             if ob:
                 ob.select = True
 
-    def cleanup_network(self):
-        """Delete all children modules."""
-        # [!] Do not call destroy on children modules. It will cause infinite
-        # call loop.
-        for obj in self.obj_ptr.children:
-            self.delete_object(obj)
-
     def cleanup_bridge(self):
         """Remove references of self object and also pointer to joints."""
         # Preserve neighbor joints for pg-network separation
@@ -315,6 +318,7 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
                 neighbors[lk.target_mod.name] = lk.target_mod
         old_network = self.obj_ptr.parent
         self.sever_links()
+        lh.NetworkIndex().remove(self.obj_ptr)
 
         # Destroy mirrors
         for m in self.mirrors:
@@ -325,14 +329,8 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
         # Remove self from parent
         self.obj_ptr.parent = None
 
-        # Separate networks
-        while neighbors:
-            name, mod = neighbors.popitem()
-
-            # Could become None in some situations,
-            # such as a deleted mirrors
-            if mod and mod.parent == old_network:
-                lh.transfer_network(mod)
+        # Separate networks, but only if removing self split it
+        lh.split_network(old_network, neighbors.values())
 
     def init_network(self, obj, network_type):
         assert network_type in {'module', 'pguide'}
@@ -430,6 +428,7 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
         link.terminus = 'c'
         link.target_mod = target_mod
         link.target_chain_id = target_chain_id
+        lh.NetworkIndex().link(self.obj_ptr, target_mod)
         return link
 
     def new_n_link(self, source_chain_id, target_mod, target_chain_id):
@@ -438,6 +437,7 @@ class ElfinObjectProperties(bpy.types.PropertyGroup):
         link.terminus = 'n'
         link.target_mod = target_mod
         link.target_chain_id = target_chain_id
+        lh.NetworkIndex().link(self.obj_ptr, target_mod)
         return link
 
     def show_links(self):
@@ -3,7 +3,11 @@ import json
 import traceback
 
 import bpy
+import mathutils
+import mathutils.kdtree
 
+from . import collision
+from . import collision_numpy
 from . import livebuild_helper as helper
 
 # Constants --------------------------------------
@@ -33,6 +37,14 @@ class ExportOperator(bpy.types.Operator):
     bl_idname = 'elfin.export'
     bl_label = 'Export as Elfin input (#exp)'
     filepath = bpy.props.StringProperty(subtype="FILE_PATH")
+    parallel_validation = bpy.props.BoolProperty(
+        name='Parallel collision check',
+        description=('Check module collisions from the exported transforms '
+                     'across a process pool. Only parallel in background '
+                     'Blender (blender -b); the UI checks serially. Off '
+                     'by default so that results of unchanged networks '
+                     'are reused'),
+        default=False)
 
     def invoke(self, context, event):
         self.filepath = os.path.splitext(bpy.data.filepath)[0] + '.json'
@@ -56,7 +68,9 @@ class ExportOperator(bpy.types.Operator):
 
         output = create_output(networks, pg_networks)
 
-        valid, msg = validate_and_annotate(networks, pg_networks, output)
+        valid, msg = validate_and_annotate(
+            networks, pg_networks, output,
+            parallel=self.parallel_validation)
 
         if not valid:
             self.report({'ERROR'}, msg)
@@ -77,6 +91,51 @@ class ExportOperator(bpy.types.Operator):
 # Helpers ----------------------------------------
 
 
+class ModuleLocator(object):
+    """KD-tree of module COMs (origins) with their bounding spheres, built
+    once per export so that all joints can be located against it.
+    """
+
+    def __init__(self, mods, scale_factor=collision.default_scale_factor):
+        self.mods = list(mods)
+        self.scale_factor = scale_factor
+        self.coms = [mod.matrix_world.translation.copy() for mod in self.mods]
+        self.spheres = [collision.bounding_sphere(mod, scale_factor)
+                        for mod in self.mods]
+
+        # Furthest any module's bounds reach from its COM
+        self.max_reach = max((radius + (center - com).length
+                              for com, (center, radius)
+                              in zip(self.coms, self.spheres)), default=0.0)
+
+        # World-space BVHs, built once per object for the whole export
+        self.trees = {}
+
+        self.tree = mathutils.kdtree.KDTree(len(self.mods))
+        for i, com in enumerate(self.coms):
+            self.tree.insert(com, i)
+        self.tree.balance()
+
+    def find_candidates(self, obj):
+        """Returns modules whose bounding spheres overlap obj's."""
+        center, radius = collision.bounding_sphere(obj, self.scale_factor)
+        hits = []
+        for _, i, _ in self.tree.find_range(center, radius + self.max_reach):
+            mod_center, mod_radius = self.spheres[i]
+            if (mod_center - center).length <= radius + mod_radius:
+                hits.append(self.mods[i])
+        return hits
+
+    def find_overlap(self, obj):
+        """Returns modules whose meshes overlap obj's, mesh-testing only
+        the candidates from find_candidates().
+        """
+        return collision.find_collisions(
+            {obj: self.find_candidates(obj)},
+            self.scale_factor,
+            self.trees)[obj]
+
+
 def coms_approximately_equal(a, b, tolerance=1e-5):
     return all(abs(x) < tolerance for x in a - b)
 
@@ -102,9 +161,29 @@ def create_output(networks, pg_networks):
     return output
 
 
-def validate_and_annotate(networks, pg_networks, output):
+def find_design_collision_map(output, processes=None):
+    """Module collision map computed from the exported networks and the
+    prototype mesh arrays, with pair tests spread across a process pool.
+    Has the same shape as helper.get_module_collision_map().
+    """
+    mod_names = {mod['module_name']
+                 for network in output['networks'].values()
+                 for mod in network.values()}
+    name_map = collision_numpy.find_design_collisions(
+        output, helper.get_prototype_meshes(mod_names),
+        collision.default_scale_factor, processes)
+
+    objects = bpy.data.objects
+    return {objects[name]: [objects[other] for other in others]
+            for name, others in name_map.items()}
+
+
+def validate_and_annotate(networks, pg_networks, output, parallel=False):
     """Checks through modules and joints for unintended collisions. Modifies
     output dictionary to mark occupancy.
+
+    If parallel is True, module collisions are checked by
+    find_design_collision_map() instead of against the live scene.
     """
     validity, msg = True, ''
 
@@ -122,17 +201,17 @@ def validate_and_annotate(networks, pg_networks, output):
         C) Joint collides with multiple modules.
     """
     try:
-        collision_map = helper.get_module_collision_map()
+        if parallel:
+            collision_map = find_design_collision_map(output)
+        else:
+            collision_map = helper.get_module_collision_map()
         if any(collision_map.values()):
             # 1.
             validity = False
-            colliding_pairs = set()
-            for k, v in collision_map.items():
-                for vmod in v:
-                    if (vmod.name, k.name) in colliding_pairs:
-                        continue
-                    # Exclude reversed names
-                    colliding_pairs.add((k.name, vmod.name))
+            # The map is symmetric: keep one ordering of each pair
+            colliding_pairs = {tuple(sorted((k.name, vmod.name)))
+                               for k, v in collision_map.items()
+                               for vmod in v}
             collision_info = \
                 '\n'.join('\"{}\" collides with \"{}\"'.format(mod1, mod2)
                           for mod1, mod2 in colliding_pairs)
@@ -142,16 +221,18 @@ def validate_and_annotate(networks, pg_networks, output):
                     collision_info
         else:
             # 2.
+            bpy.context.scene.update()
+            locator = ModuleLocator(produce(networks))
             for jt in produce(pg_networks):
-                colliding_mods = helper.find_overlap(jt, produce(networks))
+                colliding_mods = locator.find_overlap(jt)
                 if not colliding_mods:
                     continue
                 print('{} collision: {}.'.format(jt.name, colliding_mods))
                 if len(colliding_mods) == 1:
                     jt_com = jt.matrix_world.translation
                     mod = colliding_mods[0]
-                    mod_com = mod.matrix_world.translation
-                    if coms_approximately_equal(jt_com, mod_com):
+                    if coms_approximately_equal(
+                            mod.matrix_world.translation, jt_com):
                         # A)
                         if mod.elfin.get_available_links() < \
                                 len(jt.elfin.pg_neighbors):
@@ -4,6 +4,7 @@ import json
 import bpy
 import mathutils
 
+from . import kinematics
 from . import livebuild_helper as helper
 from .export import exporter_field, elfin_ui_exporter
 
@@ -105,61 +106,34 @@ def materialize(json_data):
     return err_msg
 
 
+@helper.deferred_scene_update()
 def project_nodes(nodes, new_nw_name):
-    first_node = True
-    solution_nodes = []
-    prev_node = None
-    for node in nodes:
-        print('Projecting ', node['name'])
-
-        if first_node:
-            first_node = False
-
-            # Add first module.
-            new_mod = helper.add_module(
-                node['name'],
-                color=helper.ColorWheel().next_color(),
-                follow_selection=False)
-
-            solution_nodes.append(new_mod)
-
-            # Project node.
-            tx = mathutils.Matrix(node['rot']).to_4x4()
-            # Must not use direct Vector division by scalar here
-            # before Blender's Vector scalar division is less accurate than
-            # float division
-            tx.translation = [f / helper.blender_pymol_unit_conversion
-                              for f in node['tran']]
-            new_mod.matrix_world = tx * new_mod.matrix_world
-
-        else:
-            src_term = prev_node['src_term'].lower()
-            src_chain_name = prev_node['src_chain_name']
-            dst_chain_name = prev_node['dst_chain_name']
-
-            selector = helper.module_enum_tuple(
-                node['name'],
-                extrude_from=src_chain_name,
-                extrude_into=dst_chain_name,
-                direction=src_term)[0]
-
-            imported, _ = helper.extrude_terminus(
-                which_term=src_term,
-                selector=selector,
-                sel_mod=new_mod,
-                color=helper.ColorWheel().next_color(),
-                reporter=None)
-
-            assert(len(imported) == 1)
-
-            new_mod = imported[0]
-            solution_nodes.append(new_mod)
-
-        prev_node = node
+    # Fetch every prototype of the solution in one library load.
+    helper.preload_modules([node['name'] for node in nodes])
+
+    if not nodes:
+        return
+
+    # Add first module.
+    first_node = nodes[0]
+    print('Projecting ', first_node['name'])
+    new_mod = helper.add_module(
+        first_node['name'],
+        color=helper.ColorWheel().next_color(),
+        follow_selection=False)
+
+    # Project node.
+    tx = mathutils.Matrix(kinematics.node_transform(first_node).tolist())
+    helper.set_matrix_world(
+        new_mod, tx * helper.evaluated_matrix_world(new_mod))
+
+    # Every other node is extruded from its predecessor in one batch.
+    steps = kinematics.solution_steps(nodes)
+    chain, _ = helper.extrude_chain(new_mod, steps)
+    solution_nodes = [new_mod] + chain
 
     # Name network and select all nodes.
-    if solution_nodes:
-        solution_nodes[0].parent.name = new_nw_name
+    solution_nodes[0].parent.name = new_nw_name
 
-        for node in solution_nodes:
-            node.select = True
+    for node in solution_nodes:
+        node.select = True
@@ -0,0 +1,163 @@
+import numpy as np
+
+try:
+    from . import xdb_index
+except ImportError:
+    # Imported headless with elfin/ on sys.path: the elfin package itself
+    # needs bpy.
+    import xdb_index
+
+# Forward kinematics of module chains. This module stays free of bpy so that
+# poses can be computed (and solver output checked) before any object exists,
+# including by headless tooling.
+#
+# All transforms are float64 arrays of shape (4, 4) or (N, 4, 4) in Blender
+# units. A step is (which_term, src_chain, dst_chain, mod_name), meaning
+# mod_name is attached at which_term of the module before it, as used by
+# livebuild_helper.extrude_chain().
+
+# Helpers ----------------------------------------
+
+
+def module_type(xdb, mod_name):
+    if mod_name in xdb['modules']['singles']:
+        return 'single'
+    if mod_name in xdb['modules']['hubs']:
+        return 'hub'
+    raise ValueError('{} is neither a single nor a hub'.format(mod_name))
+
+
+def step_row(tx_table, fixed_name, fixed_type, step, ext_type):
+    """Returns (row, invert) of the tx_table transform that takes the frame
+    of step's module to fixed_name's. Raises KeyError if the chains are not
+    compatible.
+    """
+    which_term, src_chain, dst_chain, ext_name = step
+    assert which_term in {'n', 'c'}
+
+    if which_term == 'n':
+        mod_params = (ext_name, dst_chain, fixed_name, src_chain)
+    else:
+        mod_params = (fixed_name, src_chain, ext_name, dst_chain)
+
+    mod_types = (fixed_type, ext_type)
+    if mod_types == ('single', 'single'):
+        invert = which_term == 'n'
+
+    elif mod_types == ('single', 'hub'):
+        # dbgen.py only creates Hub-to-Single transforms. Single-to-Hub is
+        # therefore always the inverse.
+        invert = True
+
+    elif mod_types == ('hub', 'single'):
+        invert = False
+
+    else:
+        raise ValueError('Invalid mod_types: ({}, {})'.format(*mod_types))
+
+    return tx_table.row(*mod_params), invert
+
+
+def relative_transform(tx_table, fixed_name, fixed_type, step, ext_type):
+    """Returns the (4, 4) transform of step's module relative to
+    fixed_name's frame.
+    """
+    row, invert = step_row(tx_table, fixed_name, fixed_type, step, ext_type)
+    return (tx_table.inv if invert else tx_table.fwd)[row].copy()
+
+
+def relative_transforms(xdb, tx_table, start_name, steps):
+    """Returns the (N, 4, 4) transforms of each step's module relative to
+    the module before it, gathered from tx_table in one indexing pass.
+    """
+    n_steps = len(steps)
+    rows = np.zeros(n_steps, dtype=np.intp)
+    inverted = np.zeros(n_steps, dtype=bool)
+
+    fixed_name = start_name
+    fixed_type = module_type(xdb, start_name)
+    for i, step in enumerate(steps):
+        ext_type = module_type(xdb, step[3])
+        rows[i], inverted[i] = step_row(
+            tx_table, fixed_name, fixed_type, step, ext_type)
+        fixed_name, fixed_type = step[3], ext_type
+
+    return np.where(inverted[:, None, None],
+                    tx_table.inv[rows],
+                    tx_table.fwd[rows])
+
+
+def chain_transforms(relative, base=None, frames=None):
+    """Returns the (N, 4, 4) world transforms of a chain.
+
+    World transform i is base * relative[0] * frames[0] * ... *
+    relative[i] * frames[i]. The prefix products are computed as a scan of
+    batched matrix products, so there are log2(N) numpy calls rather than N.
+
+    Args:
+     - relative: (N, 4, 4) transforms from relative_transforms().
+     - base: optional (4, 4) world transform of the start module, without
+       scale.
+     - frames: optional (N, 4, 4) rigid transforms of each module's own
+       frame, e.g. the scaleless part of its prototype's matrix_world.
+
+    base and frames may be anything numpy can read as rows, including
+    mathutils matrices.
+    """
+    poses = np.array(relative, dtype=np.float64).reshape(-1, 4, 4)
+    if frames is not None:
+        frames = np.asarray(frames, dtype=np.float64).reshape(-1, 4, 4)
+        poses = np.matmul(poses, frames)
+
+    offset = 1
+    while offset < len(poses):
+        poses[offset:] = np.matmul(poses[:-offset], poses[offset:])
+        offset *= 2
+
+    if base is not None:
+        poses = np.matmul(np.asarray(base, dtype=np.float64), poses)
+
+    return poses
+
+
+def node_transform(node):
+    """Returns the (4, 4) world transform that the solver gave node."""
+    tx = np.identity(4)
+    tx[:3, :3] = node['rot']
+    tx[:3, 3] = node['tran']
+    tx[:3, 3] /= xdb_index.blender_pymol_unit_conversion
+    return tx
+
+
+def solution_steps(nodes):
+    """Returns the steps that extrude nodes[1:] from nodes[0]."""
+    return [(prev_node['src_term'].lower(),
+             prev_node['src_chain_name'],
+             prev_node['dst_chain_name'],
+             node['name'])
+            for prev_node, node in zip(nodes, nodes[1:])]
+
+
+def solution_transforms(nodes, xdb, tx_table=None, frames=None):
+    """Returns the (N, 4, 4) world transforms of a solver node list.
+
+    The first node is placed where the solver put it and every other node
+    is chained from the xdb, which is what project_nodes() builds.
+    Raises KeyError if two consecutive nodes are not compatible.
+    """
+    if not nodes:
+        return np.zeros((0, 4, 4))
+
+    if tx_table is None:
+        tx_table = xdb_index.TransformTable(xdb)
+
+    base = node_transform(nodes[0])
+    if frames is not None:
+        frames = np.asarray(frames, dtype=np.float64)
+        base = np.matmul(base, frames[0])
+        frames = frames[1:]
+
+    relative = relative_transforms(
+        xdb, tx_table, nodes[0]['name'], solution_steps(nodes))
+    return np.concatenate(
+        (base[None], chain_transforms(relative, base, frames)))
@@ -2,8 +2,16 @@ import bpy
 import mathutils
 from bpy_extras import view3d_utils
 
+from . import collision
 from . import livebuild_helper as helper
 
+# Property groups --------------------------------
+
+
+class ObjectName(bpy.types.PropertyGroup):
+    """Item of a CollectionProperty that lists objects by (built-in) name."""
+    pass
+
 # Path guide operators ---------------------------
 
 
@@ -281,15 +289,6 @@ class JoinNetworks(bpy.types.Operator):
     bl_property = "way_selector"
     bl_options = {'REGISTER', 'UNDO'}
 
-    @classmethod
-    def relevant_extrudables(cls, extrudables, mod_name):
-        res = []
-        for ext in extrudables:
-            if ext != helper.color_change_placeholder_enum_tuple and \
-                    ext[0].split('.')[1] == mod_name:
-                res.append(ext)
-        return res
-
     def get_ways(self, context):
         # Check whether an extrusion is possible from mod_a to mod_b
         no_way = [helper.empty_list_placeholder_enum_tuple]
@@ -316,50 +315,26 @@ class JoinNetworks(bpy.types.Operator):
             if helper.hub_is_symmetric(b_mod_name):
                 return no_way
 
-        # Plan: get n/c extrudables for both modules, then find out the
-        # shared termini and let the user choose
-        n_extrudables, c_extrudables = \
-            helper.LivebuildState().get_all_extrudables(mod_a)
-        an_extrudables = JoinNetworks.relevant_extrudables(
-            n_extrudables, b_mod_name)
-        ac_extrudables = JoinNetworks.relevant_extrudables(
-            c_extrudables, b_mod_name)
-
-        if len(an_extrudables) == 0 and len(ac_extrudables) == 0:
-            return no_way
-
-        n_extrudables, c_extrudables = \
-            helper.LivebuildState().get_all_extrudables(mod_b)
-        bn_extrudables = JoinNetworks.relevant_extrudables(
-            n_extrudables, a_mod_name)
-        bc_extrudables = JoinNetworks.relevant_extrudables(
-            c_extrudables, a_mod_name)
-
-        an_chains = {ane[0].split('.')[2] for ane in an_extrudables}
-        ac_chains = {ace[0].split('.')[0] for ace in ac_extrudables}
-        bn_chains = {bne[0].split('.')[2] for bne in bn_extrudables}
-        bc_chains = {bce[0].split('.')[0] for bce in bc_extrudables}
-
+        # Plan: look up the chains through which mod_a's n/c terminus can
+        # link to mod_b's c/n terminus and let the user choose
         ways = []
         join_sign = ' <--> '
 
         # selector format:
         # moving_mod_chain.fixed_mod_chain.which_term_of_fixed_mod
-        for an_ch in an_chains:
-            for bc_ch in bc_chains:
-                left = '.{}:{}({})'.format(mod_a.name, an_ch, 'N')
-                right = '({}){}:{}.'.format('C', bc_ch, mod_b.name)
-                an_bc = left + join_sign + right
-                selector = '.'.join([an_ch, bc_ch, 'c'])
-                ways.append((selector, an_bc, ''))
-
-        for ac_ch in ac_chains:
-            for bn_ch in bn_chains:
-                left = '.{}:{}({})'.format(mod_a.name, ac_ch, 'C')
-                right = '({}){}:{}.'.format('N', bn_ch, mod_b.name)
-                ac_bn = left + join_sign + right
-                selector = '.'.join([ac_ch, bn_ch, 'n'])
-                ways.append((selector, ac_bn, ''))
+        for an_ch, bc_ch in helper.get_joinable_chains(mod_a, 'n', mod_b):
+            left = '.{}:{}({})'.format(mod_a.name, an_ch, 'N')
+            right = '({}){}:{}.'.format('C', bc_ch, mod_b.name)
+            an_bc = left + join_sign + right
+            selector = '.'.join([an_ch, bc_ch, 'c'])
+            ways.append((selector, an_bc, ''))
+
+        for ac_ch, bn_ch in helper.get_joinable_chains(mod_a, 'c', mod_b):
+            left = '.{}:{}({})'.format(mod_a.name, ac_ch, 'C')
+            right = '({}){}:{}.'.format('N', bn_ch, mod_b.name)
+            ac_bn = left + join_sign + right
+            selector = '.'.join([ac_ch, bn_ch, 'n'])
+            ways.append((selector, ac_bn, ''))
 
         return ways if len(ways) > 0 else no_way
 
@@ -431,9 +406,11 @@ class SeverNetwork(bpy.types.Operator):
         link.sever()
         linkage.remove(linkage.find(link.source_chain_id))
 
-        # Move both sub-networks under new parents that has the correct COM
-        helper.transfer_network(mod_a)
-        helper.transfer_network(mod_b)
+        # Move both sub-networks under new parents that has the correct COM,
+        # unless another path still connects them
+        if not helper.NetworkIndex().connected(mod_a, mod_b):
+            helper.transfer_network(mod_a)
+            helper.transfer_network(mod_b)
 
     def execute(self, context):
         # mod_b is always the fixed module
@@ -854,18 +831,23 @@ class CheckCollision(bpy.types.Operator):
 
     # Allow keyword specification
     object_name = bpy.props.StringProperty(default='__unset__')
+    object_names = bpy.props.CollectionProperty(type=ObjectName)
 
     def execute(self, context):
-        check_against = [
-            o for o in context.scene.objects if o.elfin.is_module()]
-        subjects = []
-        try:
-            object_name_is_valid = True
-            subjects.append(bpy.data.objects[self.object_name])
-        except KeyError:
-            object_name_is_valid = False
-
-        if not object_name_is_valid:
+        context.scene.update()  # Update to get the correct matrices
+
+        names = [self.object_name] + [on.name for on in self.object_names]
+        subjects = [bpy.data.objects[name] for name in names
+                    if name in bpy.data.objects]
+        object_name_is_valid = len(subjects) > 0
+
+        if object_name_is_valid:
+            # Typically newly entered modules: only look up their neighbours
+            # in the persistent index.
+            subjects = [sub for sub in subjects if sub.elfin.is_module()]
+            candidates = {sub: collision.module_index.query(sub)
+                          for sub in subjects}
+        else:
             # No valid object_name specified - try using selection
             objs = helper.get_selected(-1)
 
@@ -874,11 +856,14 @@ class CheckCollision(bpy.types.Operator):
                 objs = context.scene.objects
             subjects.extend(objs)
 
-        collision_map = dict()
-        for sub in subjects:
-            if not sub.elfin.is_module():
-                continue
-            collision_map[sub] = helper.find_overlap(sub, check_against)
+            # Broad phase first so that only nearby modules get mesh tests.
+            subjects = [sub for sub in subjects if sub.elfin.is_module()]
+            check_against = [
+                o for o in context.scene.objects if o.elfin.is_module()]
+            candidates = collision.find_candidates(subjects, check_against)
+
+        all_collisions = collision.find_collisions(candidates)
+        collision_map = {sub: all_collisions[sub] for sub in subjects}
 
         if any(collision_map.values()):
             MessagePrompt.message_lines = [
@@ -896,6 +881,7 @@ class CheckCollision(bpy.types.Operator):
 
     def invoke(self, context, event):
         self.object_name = ''
+        self.object_names.clear()
         return self.execute(context)
 
 
@@ -907,7 +893,7 @@ class AddModule(bpy.types.Operator):
 
     ask_prototype = bpy.props.BoolProperty(default=True, options={'HIDDEN'})
     module_to_place = bpy.props.EnumProperty(
-        items=helper.LivebuildState().placeables)
+        items=lambda self, context: helper.LivebuildState().placeables)
     color = bpy.props.FloatVectorProperty(name="Display Color",
                                           subtype='COLOR',
                                           default=[0, 0, 0])
@@ -946,9 +932,17 @@ class DestroyObject(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO', 'INTERNAL'}
 
     name = bpy.props.StringProperty()
+    names = bpy.props.CollectionProperty(type=ObjectName)
 
     def execute(self, context):
-        bpy.data.objects[self.name].elfin.destroy()
+        names = [self.name] + [on.name for on in self.names]
+        for name in names:
+            # Destroying one object can take others (e.g. an emptied
+            # network) with it.
+            obj = bpy.data.objects.get(name)
+            if obj is not None:
+                obj.elfin.destroy(flush=False)
+        helper.flush_destroyed()
         return {'FINISHED'}
 
 
@@ -967,6 +961,8 @@ class LoadModuleLibrary(bpy.types.Operator):
 
     def execute(self, context):
         helper.LivebuildState().load_library()
+        helper.PrototypePool().invalidate()
+        collision.clear_geometry_cache()
         return {'FINISHED'}
 
 
@@ -1,20 +1,22 @@
+import collections
 import colorsys
+import contextlib
 import random
-import json
-import collections
 import functools
+import threading
+import time
 
 import bpy
-import bmesh
 import mathutils
-import mathutils.bvhtree
 from . import addon_paths
+from . import collision
+from . import collision_numpy
+from . import kinematics
+from . import xdb_index
 
 
 # Global (Const) Variables -----------------------
 
-blender_pymol_unit_conversion = 10.0
-
 # Color Change Placeholder
 #
 #   An option for Place/Extrude operator enums so that user can change the
@@ -36,6 +38,10 @@ nop_enum_selectors = {
     empty_list_placeholder
 }
 
+# Bumped by every elfin path that creates or deletes objects, so that
+# ModuleLifetimeWatcher can skip diffing the scene when nothing changed.
+object_generation = 0
+
 # Classes ----------------------------------------
 
 # Singleton Metaclass
@@ -54,7 +60,15 @@ class Singleton(type):
 
 
 class LivebuildState(metaclass=Singleton):
+    """Holds the xdb, module library and path guide listings.
+
+    Each resource is loaded on first access rather than when the addon is
+    imported. Derivatives (placeables, max_hub_branches) are recomputed
+    lazily after any of their sources is (re)loaded.
+    """
+
     def __init__(self):
+        self._lock = threading.RLock()
         self.reset()
 
     def get_all_extrudables(self, sel_mod):
@@ -62,60 +76,413 @@ class LivebuildState(metaclass=Singleton):
         self.c_extrudables = get_extrusion_prototype_list(sel_mod, 'c')
         return self.n_extrudables, self.c_extrudables
 
+    def get_extrusion_prototype_list(
+            self,
+            mod_name,
+            mod_type,
+            which_term,
+            occupied_chains):
+        """Returns the memoized extrusion prototype list of a module whose
+        which_term chains in occupied_chains are already linked.
+
+        Repeat calls return the same list object, which also keeps enum item
+        strings referenced as Blender requires.
+        """
+        key = (mod_name, which_term, occupied_chains)
+        enum_tuples = self._extrusion_cache.get(key)
+        if enum_tuples is None:
+            enum_tuples = build_extrusion_prototype_list(
+                mod_name, mod_type, which_term, occupied_chains)
+            self._extrusion_cache[key] = enum_tuples
+        return enum_tuples
+
+    # Lazily loaded resources
+
+    @property
+    def xdb(self):
+        with self._lock:
+            if self._xdb is None:
+                self.load_xdb()
+            return self._xdb
+
+    @property
+    def tx_table(self):
+        with self._lock:
+            if self._tx_table is None:
+                self.load_xdb()
+            return self._tx_table
+
+    @property
+    def compat_graph(self):
+        with self._lock:
+            if self._compat_graph is None:
+                self.load_xdb()
+            return self._compat_graph
+
+    @property
+    def library(self):
+        if self._library is None:
+            self.load_library()
+        return self._library
+
+    @property
+    def pguide(self):
+        if self._pguide is None:
+            self.load_path_guide()
+        return self._pguide
+
+    @property
+    def placeables(self):
+        if self._placeables is None:
+            self.update_derivatives()
+        return self._placeables
+
+    @property
+    def max_hub_branches(self):
+        if self._max_hub_branches is None:
+            self.update_derivatives()
+        return self._max_hub_branches
+
     def update_derivatives(self):
         res = [color_change_placeholder_enum_tuple] + \
             [module_enum_tuple(mod_name)
              for mod_name in self.get_all_module_names()]
-        self.placeables = res if len(res) > 1 else [
+        self._placeables = res if len(res) > 1 else [
             empty_list_placeholder_enum_tuple]
 
         # Find max hub termini
-        self.max_hub_branches = 0
-        for hub_name in self.xdb['modules']['hubs']:
-            hub_branches = max_hub_free_termini(hub_name, self.xdb)
-            self.max_hub_branches = max(hub_branches, self.max_hub_branches)
+        xdb = self.xdb
+        max_hub_branches = 0
+        for hub_name in xdb['modules']['hubs']:
+            hub_branches = max_hub_free_termini(hub_name, xdb)
+            max_hub_branches = max(hub_branches, max_hub_branches)
+        self._max_hub_branches = max_hub_branches
+
+    def invalidate_derivatives(self):
+        self._placeables = None
+        self._max_hub_branches = None
 
     def get_all_module_names(self):
-        groups = (self.xdb['modules']['singles'], self.xdb['modules']['hubs'])
+        xdb = self.xdb
+        groups = (xdb['modules']['singles'], xdb['modules']['hubs'])
         xdb_mod_names = {k for group in groups for k in group.keys()}
         return (mod_name for mod_name in self.library
                 if mod_name in xdb_mod_names)
 
-    def load_xdb(self, skip_derivatives_update=False):
-        with open(addon_paths.xdb_path, 'r') as file:
-            self.xdb = collections.OrderedDict(json.load(file))
-        if not skip_derivatives_update:
-            self.update_derivatives()
-        print('{}: Xdb loaded'.format(__class__.__name__))
-
-    def load_library(self, skip_derivatives_update=False):
+    def load_xdb(self):
+        with self._lock:
+            self._xdb, self._tx_table, self._compat_graph, from_cache = \
+                xdb_index.load_xdb(addon_paths.xdb_path,
+                                   addon_paths.xdb_cache_path)
+            self._extrusion_cache = {}
+            self.invalidate_derivatives()
+        print('{}: Xdb loaded{}'.format(
+            __class__.__name__, ' (cached)' if from_cache else ''))
+
+    def load_library(self):
         with bpy.types.BlendDataLibraries.load(addon_paths.modlib_path) as \
                 (data_from, data_to):
-            self.library = data_from.objects
-        if not skip_derivatives_update:
-            self.update_derivatives()
+            self._library = data_from.objects
+        self.invalidate_derivatives()
         print('{}: Module library loaded'.format(__class__.__name__))
 
     def load_path_guide(self):
         with bpy.types.BlendDataLibraries.load(addon_paths.pguide_path) as \
                 (data_from, data_to):
-            self.pguide = data_from.objects
+            self._pguide = data_from.objects
         print('{}: Path guide library loaded'.format(__class__.__name__))
 
     def reset(self):
-        self.n_extrudables = [empty_list_placeholder_enum_tuple]
-        self.c_extrudables = [empty_list_placeholder_enum_tuple]
-        self.placeables = [empty_list_placeholder_enum_tuple]
-        self.max_hub_branches = 0
-        self.load_all()
-        self.num = 3
+        """Drops all loaded resources. They get reloaded on next access."""
+        with self._lock:
+            self.n_extrudables = [empty_list_placeholder_enum_tuple]
+            self.c_extrudables = [empty_list_placeholder_enum_tuple]
+            self._xdb = None
+            self._tx_table = None
+            self._compat_graph = None
+            self._library = None
+            self._pguide = None
+            self._extrusion_cache = {}
+            self.invalidate_derivatives()
+            self.num = 3
 
     def load_all(self):
-        self.load_xdb(skip_derivatives_update=True)
-        self.load_library(skip_derivatives_update=True)
+        self.load_xdb()
+        self.load_library()
         self.load_path_guide()
         self.update_derivatives()
 
+    def warm_up(self):
+        """Starts loading the xdb in a background thread.
+
+        Only the xdb is warmed up off the main thread: the library and path
+        guide listings go through bpy, which must not be used from other
+        threads, so they are still loaded on first access.
+        """
+        def warm_up_xdb():
+            try:
+                self.xdb
+            except Exception as e:
+                print('{}: Xdb warm-up failed: {}'.format(
+                    __class__.__name__, e))
+
+        threading.Thread(target=warm_up_xdb,
+                         name='elfin-xdb-warm-up',
+                         daemon=True).start()
+
+
+class PrototypePool(metaclass=Singleton):
+    """Keeps one prototype datablock per library object.
+
+    The library file is opened once per prototype per session. New objects
+    are linked duplicates of the prototype, i.e. they share its mesh.
+
+    Prototypes are looked up by name on every use instead of keeping Python
+    references, because undo and file loads free Blender data.
+    """
+    tag = 'elfin_prototype'
+
+    def __init__(self):
+        # (library path, object name) -> prototype object name
+        self.names = {}
+
+    def find(self, lib_path, obj_name):
+        """Returns the loaded prototype, or None if it needs (re)loading."""
+        proto = bpy.data.objects.get(self.names.get((lib_path, obj_name), ''))
+        if proto is None or proto.get(self.tag) != obj_name:
+            return None
+        return proto
+
+    def get(self, lib_path, obj_name):
+        proto = self.find(lib_path, obj_name)
+        if proto is None:
+            proto = self.load(lib_path, [obj_name])[0]
+        return proto
+
+    def preload(self, lib_path, obj_names):
+        """Loads all missing prototypes in a single library load."""
+        missing = sorted({n for n in obj_names
+                          if self.find(lib_path, n) is None})
+        if missing:
+            self.load(lib_path, missing)
+
+    def load(self, lib_path, obj_names):
+        with bpy.data.libraries.load(lib_path) as (data_from, data_to):
+            data_to.objects = list(obj_names)
+
+        protos = data_to.objects
+        for obj_name, proto in zip(obj_names, protos):
+            proto[self.tag] = obj_name
+            self.names[(lib_path, obj_name)] = proto.name
+        print('{}: Loaded prototypes {}'.format(
+            __class__.__name__, ', '.join(obj_names)))
+        return protos
+
+    def instantiate(self, lib_path, obj_name):
+        """Links a new duplicate of a prototype into the scene."""
+        obj = self.get(lib_path, obj_name).copy()
+        del obj[self.tag]
+        bpy.context.scene.objects.link(obj)
+        bump_object_generation()
+        return obj
+
+    def invalidate(self):
+        """Forgets all prototypes and removes those that are unused."""
+        for name in self.names.values():
+            proto = bpy.data.objects.get(name)
+            if proto is not None and proto.get(self.tag) and \
+                    proto.users == 0:
+                bpy.data.objects.remove(proto)
+        self.names = {}
+
+
+class NetworkIndex(metaclass=Singleton):
+    """In-memory connectivity of module networks.
+
+    Kept in sync by new_n_link/new_c_link, Link.sever and module destroy()
+    so that membership questions don't need a network walk. A merge
+    relabels the smaller network. A split searches from both ends of the
+    severed link at once and relabels the side that runs out first, so
+    both cost about the size of the smaller part.
+
+    Objects are keyed by as_pointer(). Undo and file loads free Blender
+    data, so they mark the index dirty and it is rebuilt from links on next
+    use. Modules that were never linked are simply absent.
+    """
+
+    def __init__(self):
+        self.clear()
+        self.dirty = True
+
+    def clear(self):
+        self.objects = {}  # pointer -> object
+        self.names = {}  # pointer -> object name when indexed
+        self.keys_by_name = {}  # object name -> pointer
+        self.adjacency = {}  # pointer -> set of linked pointers
+        self.component_of = {}  # pointer -> component id
+        self.components = {}  # component id -> set of pointers
+        self.next_id = 0
+        self.dirty = False
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def ensure(self):
+        if self.dirty:
+            self.rebuild(bpy.context.scene)
+
+    def rebuild(self, scene):
+        self.clear()
+        for ob in scene.objects:
+            if ob.elfin.is_module():
+                self.insert(ob)
+
+    def add(self, obj):
+        key = obj.as_pointer()
+        if key not in self.adjacency:
+            self.objects[key] = obj
+            self.names[key] = obj.name
+            self.keys_by_name[obj.name] = key
+            self.adjacency[key] = set()
+            self.new_component({key})
+        return key
+
+    def new_component(self, keys):
+        comp_id = self.next_id
+        self.next_id += 1
+        for key in keys:
+            old_id = self.component_of.get(key)
+            if old_id is not None:
+                self.components[old_id].discard(key)
+            self.component_of[key] = comp_id
+        self.components[comp_id] = set(keys)
+
+    def insert(self, obj):
+        """Indexes obj together with the links it already has. One-sided
+        links (e.g. copied along with a duplicated module) are ignored.
+        """
+        self.add(obj)
+        for target in module_network_neighbors(obj):
+            if target and obj in module_network_neighbors(target):
+                self.link(obj, target)
+
+    def link(self, obj_a, obj_b):
+        self.ensure()
+        key_a, key_b = self.add(obj_a), self.add(obj_b)
+        self.adjacency[key_a].add(key_b)
+        self.adjacency[key_b].add(key_a)
+
+        comp_a, comp_b = self.component_of[key_a], self.component_of[key_b]
+        if comp_a != comp_b:
+            if len(self.components[comp_a]) < len(self.components[comp_b]):
+                comp_a, comp_b = comp_b, comp_a
+            members = self.components.pop(comp_b)
+            for key in members:
+                self.component_of[key] = comp_a
+            self.components[comp_a] |= members
+
+    def unlink(self, obj_a, obj_b):
+        self.ensure()
+        key_a, key_b = obj_a.as_pointer(), obj_b.as_pointer()
+        if key_a not in self.adjacency or key_b not in self.adjacency:
+            return
+        self.adjacency[key_a].discard(key_b)
+        self.adjacency[key_b].discard(key_a)
+        if self.component_of[key_a] == self.component_of[key_b]:
+            self.split(key_a, key_b)
+
+    def split(self, key_a, key_b):
+        """Relabels the part of a component that key_a and key_b no longer
+        both reach, if any. Returns whether the component split.
+        """
+        seen = ({key_a}, {key_b})
+        frontiers = ([key_a], [key_b])
+        while True:
+            for side in (0, 1):
+                if not frontiers[side]:
+                    self.new_component(seen[side])
+                    return True
+                key = frontiers[side].pop()
+                for nb in self.adjacency[key]:
+                    if nb in seen[1 - side]:
+                        return False
+                    if nb not in seen[side]:
+                        seen[side].add(nb)
+                        frontiers[side].append(nb)
+
+    def remove(self, obj):
+        self.discard(obj.as_pointer())
+
+    def remove_name(self, name):
+        """Forgets an object that may already be freed."""
+        key = self.keys_by_name.get(name)
+        if key is not None:
+            self.discard(key)
+
+    def discard(self, key):
+        if key not in self.adjacency:
+            return
+        for nb in list(self.adjacency[key]):
+            self.adjacency[key].discard(nb)
+            self.adjacency[nb].discard(key)
+            if self.component_of[nb] == self.component_of[key]:
+                self.split(key, nb)
+
+        comp_id = self.component_of.pop(key)
+        self.components[comp_id].discard(key)
+        if not self.components[comp_id]:
+            del self.components[comp_id]
+        del self.adjacency[key]
+        del self.objects[key]
+        name = self.names.pop(key)
+        if self.keys_by_name.get(name) == key:
+            del self.keys_by_name[name]
+
+    def members(self, obj):
+        """Returns all modules connected to obj, including obj."""
+        self.ensure()
+        key = obj.as_pointer()
+        if key not in self.component_of:
+            return [obj]
+        return [self.objects[k]
+                for k in self.components[self.component_of[key]]]
+
+    def component_id(self, obj):
+        """Returns an id shared by all connected modules."""
+        self.ensure()
+        key = obj.as_pointer()
+        return self.component_of.get(key, ('unlinked', key))
+
+    def forget(self, objs):
+        """Drops objs without split checks. Meant for removing whole
+        networks; if any dropped object was linked to one that is kept, the
+        index is rebuilt on next use instead.
+        """
+        keys = {obj.as_pointer() for obj in objs} & set(self.adjacency)
+        for key in keys:
+            if self.adjacency.pop(key) - keys:
+                self.dirty = True
+            comp_id = self.component_of.pop(key)
+            members = self.components[comp_id]
+            members.discard(key)
+            if not members:
+                del self.components[comp_id]
+            del self.objects[key]
+            name = self.names.pop(key)
+            if self.keys_by_name.get(name) == key:
+                del self.keys_by_name[name]
+
+    def connected(self, obj_a, obj_b):
+        return self.component_id(obj_a) == self.component_id(obj_b)
+
+
+class DeferredSceneUpdate(metaclass=Singleton):
+    """State of nested deferred_scene_update() contexts."""
+
+    def __init__(self):
+        self.depth = 0
+        self.pending = False
+
 
 random.seed()
 
@@ -136,11 +503,91 @@ class ColorWheel(metaclass=Singleton):
             random.random() * self.lightness_variance
         saturation = self.saturation_base + \
             random.random() * self.saturation_variance
-        return colorsys.hls_to_rgb(
+        # Snapped to the palette grid so that automatic colours share
+        # materials
+        return MaterialPalette().quantize(colorsys.hls_to_rgb(
             self.hue % 1.0,
             lightness % 1.0,
             saturation % 1.0
-        )
+        ))
+
+
+class MaterialPalette(metaclass=Singleton):
+    """A bounded cache of module display materials.
+
+    Automatic colours from ColorWheel are quantized, so that similar ones
+    share a material. Any other colour, e.g. one picked by the user, gets a
+    material of exactly that colour. When the palette is full, the least
+    recently used material that no object uses is evicted. If every material
+    is in use, an automatic colour reuses the closest existing one instead
+    of growing the palette; a picked colour is never substituted.
+
+    Materials are looked up by name because undo and file loads free
+    Blender data.
+    """
+    max_size = 64
+    levels = 8  # Quantization steps per colour channel
+    precision = 4  # Decimals kept of colours that are not quantized
+    name_prefix = 'elfin_mat_'
+
+    def __init__(self):
+        # Colour -> material name, least recently used first
+        self.names = collections.OrderedDict()
+
+    def quantize(self, color):
+        return tuple(min(round(c * self.levels), self.levels) / self.levels
+                     for c in color)
+
+    def is_quantized(self, color):
+        return tuple(color) == self.quantize(color)
+
+    def find(self, key):
+        mat = bpy.data.materials.get(self.names.get(key, ''))
+        if mat is None:
+            self.names.pop(key, None)
+        return mat
+
+    def get(self, color):
+        """Returns the palette material for color, creating it if needed."""
+        key = tuple(round(c, self.precision) for c in color)
+        mat = self.find(key)
+        if mat is not None:
+            self.names.move_to_end(key)
+            return mat
+
+        if len(self.names) >= self.max_size and not self.evict() and \
+                self.is_quantized(key):
+            key = min(self.names, key=lambda k: sum(
+                (a - b) ** 2 for a, b in zip(k, key)))
+            self.names.move_to_end(key)
+            return self.find(key)
+
+        mat = bpy.data.materials.new(
+            name=self.name_prefix + ''.join(
+                '{:02x}'.format(int(c * 255)) for c in key))
+        mat.diffuse_color = key
+        self.names[key] = mat.name
+        return mat
+
+    def evict(self):
+        """Removes the least recently used unused material, if any."""
+        for key in list(self.names):
+            mat = self.find(key)
+            if mat is None:
+                return True
+            if mat.users == 0:
+                del self.names[key]
+                bpy.data.materials.remove(mat)
+                return True
+        return False
+
+    def reclaim(self):
+        """Removes all palette materials that no object uses."""
+        for key in list(self.names):
+            mat = self.find(key)
+            if mat is not None and mat.users == 0:
+                del self.names[key]
+                bpy.data.materials.remove(mat)
 
 
 class object_receiver:
@@ -194,19 +641,19 @@ def hub_is_symmetric(hub_name):
     return LivebuildState().xdb['modules']['hubs'][hub_name]['symmetric']
 
 
-def get_n_to_c_tx(mod_a, chain_a, mod_b, chain_b):
-    xdb = get_xdb()
-    if mod_is_single(mod_a):
-        meta_a = xdb['modules']['singles'][mod_a]
-    elif mod_is_hub(mod_a):
-        meta_a = xdb['modules']['hubs'][mod_a]
+def get_tx_table():
+    return LivebuildState().tx_table
+
+
+def get_compat_graph():
+    return LivebuildState().compat_graph
 
-    tx_id = meta_a['chains'][chain_a]['c'][mod_b][chain_b]
-    tx_json = xdb['n_to_c_tx'][tx_id]
 
-    tx = mathutils.Matrix(tx_json['rot']).to_4x4()
-    tx.translation = tx_json['tran']
-    return tx
+def get_n_to_c_tx(mod_a, chain_a, mod_b, chain_b):
+    """Returns the raw (pymol unit) n_to_c_tx between two module chains."""
+    tx_table = get_tx_table()
+    row = tx_table.row(mod_a, chain_a, mod_b, chain_b)
+    return mathutils.Matrix(tx_table.raw[row].tolist())
 
 
 def mod_is_hub(mod_name):
@@ -239,6 +686,82 @@ def get_selected(n=1):
 # Helpers ----------------------------------------
 
 
+def bump_object_generation():
+    global object_generation
+    object_generation += 1
+
+
+@contextlib.contextmanager
+def deferred_scene_update():
+    """Batches the scene updates of helper operations.
+
+    Inside the context, update_scene() only records that an update is due,
+    and the scene is updated once when the outermost context exits. Helpers
+    must therefore not rely on matrix_world being evaluated; they use
+    evaluated_matrix_world() and set_matrix_world() instead.
+    """
+    state = DeferredSceneUpdate()
+    state.depth += 1
+    try:
+        yield
+    finally:
+        state.depth -= 1
+        if state.depth == 0 and state.pending:
+            state.pending = False
+            bpy.context.scene.update()
+
+
+def update_scene():
+    """Updates the scene now, or on exit of deferred_scene_update()."""
+    state = DeferredSceneUpdate()
+    if state.depth:
+        state.pending = True
+    else:
+        bpy.context.scene.update()
+
+
+def flush_scene_update():
+    """Updates the scene now, even inside deferred_scene_update(), e.g.
+    before reading evaluated meshes for collision checks.
+    """
+    DeferredSceneUpdate().pending = False
+    bpy.context.scene.update()
+
+
+def evaluated_matrix_world(obj):
+    """Returns obj's world matrix computed from the loc/rot/scale and parent
+    chain as they are now, without waiting for a scene update. Constraints
+    are not evaluated.
+    """
+    mw = obj.matrix_basis.copy()
+    while obj.parent:
+        mw = obj.matrix_parent_inverse * mw
+        obj = obj.parent
+        mw = obj.matrix_basis * mw
+    return mw
+
+
+def set_matrix_world(obj, mw):
+    """Sets obj's world matrix without relying on its parent's matrix_world
+    being up to date, unlike assigning obj.matrix_world.
+    """
+    if obj.parent:
+        parent_mw = evaluated_matrix_world(obj.parent)
+        obj.matrix_basis = \
+            (parent_mw * obj.matrix_parent_inverse).inverted() * mw
+    else:
+        obj.matrix_basis = mw
+
+
+def flush_destroyed(reclaim_colors=True):
+    """Finishes one or more ElfinObjectProperties.destroy() calls."""
+    if reclaim_colors:
+        # Give back colours no module uses anymore
+        MaterialPalette().reclaim()
+
+    update_scene()  # Flush out dead objects
+
+
 def add_module(mod_name, color, follow_selection=True):
     lmod = import_module(mod_name)
 
@@ -358,59 +881,150 @@ def transfer_network(mod, existing_network=None):
         print('Invalid object passed to transfer_network():', mod)
         return
 
-    new_network = create_network(network_type)
-
-    # Gather all network objects into a list and calculate COM
-    com = mathutils.Vector([0, 0, 0])
-    network_obj = []
-
-    walker = walk_network if network_type == 'module' else walk_pg_network
-    # old network must be walked instead of using children because when
-    # severing, we rely on link information to decide whether to split
-    # networks.
-    for m in walker(mod):
-        network_obj.append(m)
-        com += m.matrix_world.translation
-
-    existing_network_children = existing_network.children \
-        if existing_network else ()
-    for c in existing_network_children:
-        network_obj.append(c)
-        com += c.matrix_world.translation
-
-    com = com / len(network_obj)
-    new_network.location = com
-    # Mandatory update to reflect new parent transform
-    bpy.context.scene.update()
-    for m in network_obj:
-        change_parent_preserve_transform(m, new_network)
+    # Old network children can't be used because when severing, we rely on
+    # link information to decide whether to split networks.
+    if network_type == 'module':
+        network_obj = NetworkIndex().members(mod)
+    else:
+        network_obj = list(walk_pg_network(mod))
 
-    if not old_network.children:
-        print('---First network destroy:', old_network.name)
-        old_network.elfin.destroy()
+    if existing_network:
+        network_obj.extend(existing_network.children)
 
-    if existing_network and \
-            existing_network != old_network and \
-            not existing_network.children:
-        print('---Second network destroy:', existing_network.name)
-        existing_network.elfin.destroy()
+    move_to_new_networks([network_obj], network_type,
+                         (old_network, existing_network))
 
 
-def create_network(network_type):
-    """Creates and returns a new arrow object as a network parent object,
-    preserving selection.
+def split_network(old_network, mods):
+    """Gives each connected part of old_network that contains one of mods
+    its own network parent.
+
+    Parts are looked up in NetworkIndex, and all new parents are created and
+    filled in one batch. If the mods are still connected, their part still
+    moves to a new parent, so that it is re-centred at its new COM.
     """
-    selection = get_selected(-1)
-    for s in selection:
-        s.select = False
+    index = NetworkIndex()
+    parts = collections.OrderedDict()
+    for mod in mods:
+        # Could become None in some situations,
+        # such as a deleted mirrors
+        if mod and mod.parent == old_network:
+            parts.setdefault(index.component_id(mod), mod)
+
+    if not parts:
+        return []
 
-    bpy.ops.object.empty_add(type='ARROWS')
-    nw = get_selected()
-    nw.select = False
-    nw.elfin.init_network(nw, network_type)
+    return move_to_new_networks(
+        [index.members(mod) for mod in parts.values()], 'module',
+        (old_network,))
+
+
+def move_to_new_networks(groups, network_type, old_networks=()):
+    """Moves each group of objects under a new network parent placed at the
+    group's COM, with a single scene update. Old networks that are left
+    empty are destroyed.
+    """
+    new_networks = []
+    for network_obj in groups:
+        new_network = create_network(network_type)
+        com = sum((evaluated_matrix_world(m).translation
+                   for m in network_obj),
+                  mathutils.Vector([0, 0, 0]))
+        new_network.location = com / len(network_obj)
+        new_networks.append(new_network)
+
+    # Transforms are carried over explicitly, so the update can wait
+    for new_network, network_obj in zip(new_networks, groups):
+        for m in network_obj:
+            change_parent_preserve_transform(m, new_network)
+    update_scene()
+
+    # Destroying a network removes it, so go by name
+    old_names = [nw.name for nw in old_networks if nw]
+    for name in collections.OrderedDict.fromkeys(old_names):
+        old_network = bpy.data.objects.get(name)
+        if old_network and not old_network.children:
+            print('---Network destroy:', name)
+            old_network.elfin.destroy()
+
+    return new_networks
+
+
+def destroy_networks(networks, flush=True):
+    """Destroys networks together with all their members in one pass.
+
+    Unlike destroying members one by one, links and mirror lists are only
+    cleared where they point outside the destroyed set, nothing is
+    re-parented, and objects are removed with bpy.data.objects.remove
+    instead of the delete operator. Bridges go with their joints, like
+    cleanup_joint() does.
+    """
+    objs = []
+    doomed = set()
+
+    def gather(ob):
+        if ob and ob.as_pointer() not in doomed:
+            doomed.add(ob.as_pointer())
+            objs.append(ob)
+
+    for nw in networks:
+        gather(nw)
+    # objs grows while it is scanned; bridges are parented to joints.
+    for ob in objs:
+        for child in ob.children:
+            gather(child)
+        if ob.elfin.is_joint():
+            for nb in ob.elfin.pg_neighbors:
+                gather(nb.obj)
+
+    def outside(ob):
+        return ob and ob.as_pointer() not in doomed
+
+    for ob in objs:
+        # Later destroy() calls, e.g. from the watcher, become no-ops
+        ob.elfin.destroy_entered = True
+
+        for link in list(ob.elfin.n_linkage) + list(ob.elfin.c_linkage):
+            if outside(link.target_mod):
+                link.sever()
+        for nb in ob.elfin.pg_neighbors:
+            if outside(nb.obj):
+                nbs = nb.obj.elfin.pg_neighbors
+                for i in reversed(range(len(nbs))):
+                    if nbs[i].obj == ob:
+                        nbs.remove(i)
+        for m in ob.elfin.mirrors:
+            if outside(m):
+                m.elfin.mirrors = [x for x in m.elfin.mirrors if x != ob]
+
+        collision.module_index.remove(ob.name)
+
+    NetworkIndex().forget(objs)
+
+    # Remove children before their parents
+    objs.reverse()
+    was_module_network = any(nw.elfin.is_network() for nw in networks)
+    for ob in objs:
+        bpy.data.objects.remove(ob, do_unlink=True)
+    bump_object_generation()
+
+    if flush:
+        flush_destroyed(reclaim_colors=was_module_network)
 
-    for s in selection:
-        s.select = True
+
+def create_network(network_type):
+    """Creates and returns a new arrow object as a network parent object.
+
+    Uses the data API rather than the empty_add operator, so selection is
+    left untouched and no operator runs per network.
+    """
+    scene = bpy.context.scene
+    nw = bpy.data.objects.new('network', None)
+    nw.empty_draw_type = 'ARROWS'
+    nw.layers = scene.layers
+    scene.objects.link(nw)
+    bump_object_generation()
+    nw.elfin.init_network(nw, network_type)
 
     return nw
 
@@ -429,11 +1043,7 @@ def import_joint():
     """Links a bridge object and initializes it using two end joints."""
     joint = None
     try:
-        with bpy.data.libraries.load(addon_paths.pguide_path) as \
-                (data_from, data_to):
-            data_to.objects = ['joint']
-
-        joint = bpy.context.scene.objects.link(data_to.objects[0]).object
+        joint = PrototypePool().instantiate(addon_paths.pguide_path, 'joint')
         joint.elfin.init_joint(joint)
 
         return joint
@@ -449,11 +1059,8 @@ def import_bridge(joint_a, joint_b):
     """Links a bridge object and initializes it using two end joints."""
     bridge = None
     try:
-        with bpy.data.libraries.load(addon_paths.pguide_path) as \
-                (data_from, data_to):
-            data_to.objects = ['bridge']
-
-        bridge = bpy.context.scene.objects.link(data_to.objects[0]).object
+        bridge = PrototypePool().instantiate(addon_paths.pguide_path,
+                                             'bridge')
         bridge.elfin.init_bridge(bridge, joint_a, joint_b)
 
         return bridge
@@ -469,29 +1076,55 @@ def module_menu(self, context):
     self.layout.menu("INFO_MT_elfin_add", icon="PLUGIN")
 
 
-def walk_pg_network(joint, initial=True):
+def walk_graph(start, neighbors):
+    """A generator that traverses a graph of objects depth-first from start
+    and yields each object on the way, without repeating.
+
+    The traversal is iterative and tracks visited objects by pointer, so it
+    neither writes to objects nor hits the recursion limit on long chains.
+    neighbors(obj) returns an iterable of obj's adjacent objects.
+    """
+    visited = {start.as_pointer()}
+    yield start
+
+    stack = [iter(neighbors(start))]
+    while stack:
+        for obj in stack[-1]:
+            key = obj.as_pointer()
+            if key not in visited:
+                visited.add(key)
+                yield obj
+                stack.append(iter(neighbors(obj)))
+                break
+        else:
+            stack.pop()
+
+
+def pg_network_neighbors(joint):
+    for bridge_nb in joint.elfin.pg_neighbors:
+        for other_end_nb in bridge_nb.obj.elfin.pg_neighbors:
+            yield other_end_nb.obj
+
+
+def module_network_neighbors(module):
+    # Walk n-terminus first, then c-terminus
+    for n_obj in module.elfin.n_linkage:
+        yield n_obj.target_mod
+    for c_obj in module.elfin.c_linkage:
+        yield c_obj.target_mod
+
+
+def walk_pg_network(joint):
     """A generator that traverses the path guide network depth-first and
     yields each object on the way, without repeating.
     """
     if not joint.elfin.is_joint():
         joint = joint.elfin.pg_neighbors[0].obj
 
-    if initial:
-        for pg in joint.parent.children:
-            pg.elfin.node_walked = False
-
-    yield joint
-    joint.elfin.node_walked = True
-
-    for bridge_nb in joint.elfin.pg_neighbors:
-        bridge = bridge_nb.obj
-        for other_end_nb in bridge.elfin.pg_neighbors:
-            other_end = other_end_nb.obj
-            if not other_end.elfin.node_walked:
-                yield from walk_pg_network(other_end, initial=False)
+    yield from walk_graph(joint, pg_network_neighbors)
 
 
-def walk_network(module, initial=True):
+def walk_network(module):
     """A generator that traverses the module network depth-first and yields
     each object on the way, without repeating.
     """
@@ -499,27 +1132,13 @@ def walk_network(module, initial=True):
     if not module.elfin.is_module():
         return
 
-    if initial:
-        for pg in module.parent.children:
-            pg.elfin.node_walked = False
-
-    yield module
-    module.elfin.node_walked = True
-
-    # Walk n-terminus first
-    for n_obj in module.elfin.n_linkage:
-        if not n_obj.target_mod.elfin.node_walked:
-            yield from walk_network(module=n_obj.target_mod, initial=False)
-
-    # Then c-terminus
-    for c_obj in module.elfin.c_linkage:
-        if not c_obj.target_mod.elfin.node_walked:
-            yield from walk_network(module=c_obj.target_mod, initial=False)
+    yield from walk_graph(module, module_network_neighbors)
 
 
 IncompatibleModuleError = ValueError('Modules are not compatible!')
 
 
+@deferred_scene_update()
 def extrude_terminus(which_term, selector, sel_mod, color, reporter):
     """Extrudes selector module at the which_term of sel_mod"""
     assert which_term in {'n', 'c'}
@@ -563,7 +1182,12 @@ def extrude_terminus(which_term, selector, sel_mod, color, reporter):
                 reporter.report({'ERROR'}, str(IncompatibleModuleError))
                 raise IncompatibleModuleError
 
-            ext_mod.matrix_world = tx * ext_mod.matrix_world
+            # ext_mod is fresh from the prototype, but mirrors may already
+            # be parented to a network. Its local matrix is still the
+            # prototype's world matrix, so project that instead.
+            set_matrix_world(
+                ext_mod,
+                tx * ext_mod.matrix_parent_inverse * ext_mod.matrix_basis)
 
             # Create link
             if which_term == 'n':
@@ -579,8 +1203,8 @@ def extrude_terminus(which_term, selector, sel_mod, color, reporter):
             print('Debug: done linking')
 
             # Touch up
-            bpy.context.scene.update()  # Update to get the correct matrices
             change_parent_preserve_transform(ext_mod, fixed_mod.parent)
+            update_scene()
 
             give_module_new_color(ext_mod, color)
             ext_mod.hide = False  # Unhide (default is hidden)
@@ -694,29 +1318,37 @@ def get_extrusion_prototype_list(sel_mod, which_term):
     """
     assert which_term in {'n', 'c'}
 
-    enum_tuples = [color_change_placeholder_enum_tuple]
-
     # Selection length is guranteed by poll()
-    sel_mod_name = sel_mod.elfin.module_name
-    sel_mod_type = sel_mod.elfin.module_type
+    linkage = sel_mod.elfin.n_linkage if which_term == 'n' else \
+        sel_mod.elfin.c_linkage
+
+    return LivebuildState().get_extrusion_prototype_list(
+        sel_mod.elfin.module_name,
+        sel_mod.elfin.module_type,
+        which_term,
+        frozenset(linkage.keys()))
+
+
+def build_extrusion_prototype_list(
+        sel_mod_name,
+        sel_mod_type,
+        which_term,
+        occupied_termini):
+    """Builds the prototype list of get_extrusion_prototype_list() from the
+    compatibility graph.
+    """
+    enum_tuples = [color_change_placeholder_enum_tuple]
 
-    xdb = get_xdb()
+    graph = get_compat_graph()
     if sel_mod_type == 'hub':
-        hub_meta = xdb['modules']['hubs'][sel_mod_name]
-        if which_term == 'n':
-            occupied_termini = sel_mod.elfin.n_linkage.keys()
-        else:
-            occupied_termini = sel_mod.elfin.c_linkage.keys()
+        symmetric = hub_is_symmetric(sel_mod_name)
 
-        for src_chain_id, chain_meta in hub_meta['chains'].items():
+        for src_chain_id in graph.get_chains(sel_mod_name):
             if src_chain_id in occupied_termini:
                 continue
 
-            for single_name in chain_meta[which_term]:
-                single_chains = chain_meta[which_term][single_name]
-                assert(len(single_chains) == 1)
-                dst_chain_id = list(single_chains.keys())[0]
-
+            for single_name, dst_chain_id in graph.get_partners(
+                    sel_mod_name, src_chain_id, which_term):
                 enum_tuples.append(
                     module_enum_tuple(
                         single_name,
@@ -726,31 +1358,23 @@ def get_extrusion_prototype_list(sel_mod, which_term):
 
             # Only allow one chain to be extruded because other
             # "mirrors" will be generated automatically
-            if hub_meta['symmetric']:
+            if symmetric:
                 break
     elif sel_mod_type == 'single':
         # Checks for occupancy by counting n/c termini links
-        if which_term == 'n':
-            link_len = len(sel_mod.elfin.n_linkage)
-        else:
-            link_len = len(sel_mod.elfin.c_linkage)
-
-        if link_len == 0:
-            single_meta = xdb['modules']['singles'][sel_mod_name]
-            chain_meta = single_meta['chains']
-            chain_id_list = list(chain_meta.keys())
+        if len(occupied_termini) == 0:
+            chain_id_list = graph.get_chains(sel_mod_name)
             assert len(chain_id_list) == 1
 
             single_chain_name = chain_id_list[0]
-            term_meta = chain_meta[single_chain_name][which_term]
-            for ext_mod_name in term_meta:
-                for ext_mod_chain_name in term_meta[ext_mod_name]:
-                    enum_tuples.append(
-                        module_enum_tuple(
-                            ext_mod_name,
-                            extrude_from=single_chain_name,
-                            extrude_into=ext_mod_chain_name,
-                            direction=which_term))
+            for ext_mod_name, ext_mod_chain_name in graph.get_partners(
+                    sel_mod_name, single_chain_name, which_term):
+                enum_tuples.append(
+                    module_enum_tuple(
+                        ext_mod_name,
+                        extrude_from=single_chain_name,
+                        extrude_into=ext_mod_chain_name,
+                        direction=which_term))
     else:
         raise ValueError('Unknown module type: ', sel_mod_type)
 
@@ -759,9 +1383,12 @@ def get_extrusion_prototype_list(sel_mod, which_term):
 
 
 def change_parent_preserve_transform(child, new_parent):
-    mw = child.matrix_world.copy()
+    mw = evaluated_matrix_world(child)
     child.parent = new_parent
-    child.matrix_world = mw
+    set_matrix_world(child, mw)
+
+    # Module bounds are indexed relative to their network parent.
+    collision.module_index.update(child)
 
 
 def get_tx(
@@ -775,41 +1402,134 @@ def get_tx(
     """Returns the transformation matrix for when ext_mod is extruded from
     fixed_mod's which_term.
     """
-    assert which_term in {'n', 'c'}
+    tx = get_relative_tx(
+        fixed_mod.elfin.module_name,
+        extrude_from,
+        extrude_into,
+        ext_mod.elfin.module_name,
+        which_term,
+        mod_types)
+    return equalize_frame(tx, fixed_mod)
+
+
+def get_relative_tx(
+    fixed_mod_name,
+    extrude_from,
+    extrude_into,
+    ext_mod_name,
+    which_term,
+    mod_types
+):
+    """Returns the transformation of ext_mod_name's frame relative to
+    fixed_mod_name's when extruded from its which_term. Raises KeyError if
+    the chains are not compatible.
+    """
+    # Blender-scaled transforms and their inverses are precompiled by
+    # LivebuildState.load_xdb().
+    tx = kinematics.relative_transform(
+        get_tx_table(),
+        fixed_mod_name,
+        mod_types[0],
+        (which_term, extrude_from, extrude_into, ext_mod_name),
+        mod_types[1])
+    return mathutils.Matrix(tx.tolist())
+
+
+@deferred_scene_update()
+def extrude_chain(start_mod, steps, color=None):
+    """Extrudes a chain of modules from start_mod in one batch.
+
+    Unlike repeated extrude_terminus() calls, all world transforms are
+    computed up front from the xdb, so nothing is created if any step is
+    incompatible. Modules are then created, placed, linked and coloured in
+    bulk, and the scene is updated once. Mirrors are not extruded.
 
-    fixed_mod_name = fixed_mod.elfin.module_name
-    ext_mod_name = ext_mod.elfin.module_name
+    Args:
+     - start_mod: the module the chain grows from.
+     - steps: list of (which_term, src_chain, dst_chain, mod_name); each
+       step extrudes mod_name at which_term of the previous module.
+     - color: optional colour for all new modules; by default each gets the
+       next ColorWheel colour.
 
-    tx = None
+    Returns:
+     - (new modules, {stage: seconds})
+    """
+    timings = collections.OrderedDict()
+    lap_start = [time.time()]
+
+    def lap(stage):
+        now = time.time()
+        timings[stage] = now - lap_start[0]
+        lap_start[0] = now
+
+    if not steps:
+        return [], timings
+
+    mod_names = [step[3] for step in steps]
+    preload_modules(mod_names)
+    lap('preload')
+
+    # Poses chain like get_tx(): each step is relative to the scaleless
+    # frame of the module before it, which includes any rotation baked into
+    # the prototype. Only the prototype's scale is left to apply.
+    pool = PrototypePool()
+    protos = [pool.get(addon_paths.modlib_path, n) for n in mod_names]
+    frames = [rigid_part(proto.matrix_world) for proto in protos]
     try:
-        if which_term == 'n':
-            mod_params = (ext_mod_name, extrude_into,
-                          fixed_mod_name, extrude_from)
-        else:
-            mod_params = (fixed_mod_name, extrude_from,
-                          ext_mod_name, extrude_into)
-
-        n_to_c_tx = get_n_to_c_tx(*mod_params)
-
-        if mod_types == ('single', 'single'):
-            tx = scale_and_shift(n_to_c_tx, which_term == 'n', fixed_mod)
+        relative = kinematics.relative_transforms(
+            get_xdb(), get_tx_table(), start_mod.elfin.module_name, steps)
+    except KeyError:
+        raise IncompatibleModuleError
+    poses = kinematics.chain_transforms(
+        relative,
+        base=rigid_part(evaluated_matrix_world(start_mod)),
+        frames=frames)
+    worlds = [mathutils.Matrix(pose.tolist()) *
+              frame.inverted() * proto.matrix_world
+              for pose, frame, proto in zip(poses, frames, protos)]
+    lap('transforms')
+
+    mods = import_modules(mod_names)
+    lap('import')
 
-        elif mod_types == ('single', 'hub'):
-            # dbgen.py only creates Hub-to-Single transforms. Single-to-Hub is
-            # therefore always the inverse.
-            tx = scale_and_shift(n_to_c_tx, True, fixed_mod)
-
-        elif mod_types == ('hub', 'single'):
-            tx = scale_and_shift(n_to_c_tx, False, fixed_mod)
+    try:
+        network = start_mod.parent
+        for mod, world in zip(mods, worlds):
+            mod.parent = network
+            set_matrix_world(mod, world)
+        lap('place')
+
+        prev_mod = start_mod
+        for (which_term, src_chain, dst_chain, _), mod in zip(steps, mods):
+            if which_term == 'n':
+                prev_mod.elfin.new_n_link(src_chain, mod, dst_chain)
+                mod.elfin.new_c_link(dst_chain, prev_mod, src_chain)
+            else:
+                prev_mod.elfin.new_c_link(src_chain, mod, dst_chain)
+                mod.elfin.new_n_link(dst_chain, prev_mod, src_chain)
+            prev_mod = mod
+        lap('link')
+
+        for mod in mods:
+            give_module_new_color(mod, color)
+            mod.hide = False  # Unhide (default is hidden)
+        lap('color')
+    except Exception as e:
+        for mod in mods:
+            mod.elfin.destroy(flush=False)
+        flush_destroyed()
+        raise e
 
-        else:
-            raise ValueError('Invalid mod_types: ({}, {})'.format(*mod_types))
+    flush_scene_update()
+    lap('commit')
 
-    except KeyError as ke:
-        tx = None
-        raise ke
+    print('extrude_chain: {} modules in {:.1f} ms ({})'.format(
+        len(mods),
+        sum(timings.values()) * 1000,
+        ', '.join('{} {:.1f} ms'.format(stage, secs * 1000)
+                  for stage, secs in timings.items())))
 
-    return tx
+    return mods, timings
 
 
 def unlink_mirror(modules=None):
@@ -839,12 +1559,10 @@ def mirrored_symhub_extrude(
         hub_free_chains,
         ext_mod_name,
         extrude_func):
-    imported = []
-
-    for src_chain_id in hub_free_chains:
-        mirror_mod = import_module(ext_mod_name)
-        imported.append(mirror_mod)
+    hub_free_chains = list(hub_free_chains)
+    imported = import_modules([ext_mod_name] * len(hub_free_chains))
 
+    for src_chain_id, mirror_mod in zip(hub_free_chains, imported):
         # Assign to the same network.
         mirror_mod.parent = root_symhub.parent
         extrude_func(root_symhub, mirror_mod, src_chain_id)
@@ -861,16 +1579,13 @@ def mirrored_extrude(
         new_mirrors,
         ext_mod_name,
         extrude_func):
-    imported = []
-
-    for m in root_mod.elfin.mirrors:
-        if m != root_mod:
-            mirror_mod = import_module(ext_mod_name)
-            imported.append(mirror_mod)
+    other_mirrors = [m for m in root_mod.elfin.mirrors if m != root_mod]
+    imported = import_modules([ext_mod_name] * len(other_mirrors))
 
-            # Assign to the same network.
-            mirror_mod.parent = m.parent
-            new_mirrors += extrude_func(m, mirror_mod)
+    for m, mirror_mod in zip(other_mirrors, imported):
+        # Assign to the same network.
+        mirror_mod.parent = m.parent
+        new_mirrors += extrude_func(m, mirror_mod)
 
     for m in new_mirrors:
         m.elfin.mirrors = new_mirrors
@@ -908,86 +1623,40 @@ def suitable_for_extrusion(context):
 
 
 def give_module_new_color(mod, new_color=None):
-    mat = bpy.data.materials.new(name='mat_' + mod.name)
-    mat.diffuse_color = new_color if new_color else ColorWheel().next_color()
-    mod.data.materials.append(mat)
-    mod.active_material = mat
+    mat = MaterialPalette().get(
+        new_color if new_color else ColorWheel().next_color())
+
+    # Modules share their prototype's mesh, so the material must be linked
+    # to the object rather than to the mesh.
+    if not mod.material_slots:
+        mod.data.materials.append(None)
+    slot = mod.material_slots[mod.active_material_index]
+    slot.link = 'OBJECT'
+    slot.material = mat
 
 
 def get_module_collision_map():
     """Checks all elfin modules for collision and returns a map of which
     modules collide which.
     """
-    bpy.context.scene.update()
+    flush_scene_update()
     mods = [o for o in bpy.context.scene.objects if o.elfin.is_module()]
-    collision_map = {mod: [] for mod in mods}
-
-    for mod in collision_map:
-        collision_map[mod] = find_overlap(mod, mods)
-
-    return collision_map
-
-
-def find_overlap(test_obj, obj_list, scale_factor=0.90):
-    """
-    Tests whether an object's mesh overlaps with any mesh in obj_list.
-
-    The collision check will be skipped for test_obj itself, and its
-    immediate neighbors.
-
-    Args:
-     - test_obj - the object under test.
-     - obj_list - optional; the list of objects to test against.
-     - scale_factor - optional; the scale to apply before testing.
-
-    Returns:
-     - list of colliding objects
-    """
-    bpy.context.scene.update()
-    scale = mathutils.Matrix.Scale(scale_factor, 4)
-
-    mod_bm = bmesh.new()
-    mod_bm.from_mesh(test_obj.data)
-    mod_bm.transform(test_obj.matrix_world * scale)
-    mod_bvh_tree = mathutils.bvhtree.BVHTree.FromBMesh(mod_bm)
-    colliding_objs = []
-    for ob in obj_list:
-        # Skip the test subject itself and its immediate neigbors.
-        if ob == test_obj or test_obj.elfin.find_link(ob):
-            continue
-        
-        ob_bm = bmesh.new()
-        ob_bm.from_mesh(ob.data)
-        ob_bm.transform(ob.matrix_world * scale)
-        ob_bvh_tree = mathutils.bvhtree.BVHTree.FromBMesh(ob_bm)
-
-        overlaps = mod_bvh_tree.overlap(ob_bvh_tree)
-
-        if len(overlaps) > 0:
-            colliding_objs.append(ob)
 
-    return colliding_objs
+    # Only spatially close modules are sent to the mesh overlap test, and
+    # each pair only once.
+    return collision.find_collisions(collision.find_candidates(mods, mods))
 
 
-def scale_and_shift(n_to_c_tx, invert=False, fixed_mod=None):
-    tx = pymol_to_blender_scale(n_to_c_tx)
-
-    if invert:
-        tran = tx.translation.copy()
-        tx.translation = [0, 0, 0]
-        tx.transpose()
-        tx.translation = tx * -tran
-
-    if fixed_mod is not None:
-        tx = equalize_frame(tx, fixed_mod)
-    return tx
+def equalize_frame(tx, fixed_mod):
+    return rigid_part(evaluated_matrix_world(fixed_mod)) * tx
 
 
-def equalize_frame(tx, fixed_mod):
-    trans, rot, _ = fixed_mod.matrix_world.decompose()
-    delta = rot.to_matrix().to_4x4()
-    delta.translation = trans
-    return delta * tx
+def rigid_part(matrix):
+    """Returns matrix without its scale."""
+    trans, rot, _ = matrix.decompose()
+    rigid = rot.to_matrix().to_4x4()
+    rigid.translation = trans
+    return rigid
 
 
 def scaleless_rot_tran(obj):
@@ -1000,27 +1669,44 @@ def scaleless_rot_tran(obj):
     return rot, tran
 
 
-def pymol_to_blender_scale(n_to_c_tx):
-    tx = mathutils.Matrix(n_to_c_tx)
-    for i in range(0, 3):
-        tx[i][3] /= blender_pymol_unit_conversion
-    return tx
-
-
 def get_compatible_hub_chains(hub_name, single_term, single_name):
     assert single_term in {'n', 'c'}
 
     hub_term = {'n': 'c', 'c': 'n'}[single_term]
 
-    chain_meta = get_xdb()['modules']['hubs'][hub_name]['chains']
-
     compat_hub_chains = []
-    for chain_name in chain_meta:
-        if single_name in chain_meta[chain_name][hub_term].keys():
+    for chain_name, _ in get_compat_graph().get_links(
+            hub_name, hub_term, single_name):
+        if chain_name not in compat_hub_chains:
             compat_hub_chains.append(chain_name)
     return compat_hub_chains
 
 
+def get_joinable_chains(mod_a, which_term, mod_b):
+    """Returns (chain_a, chain_b) pairs through which mod_b can be linked to
+    mod_a's which_term, excluding chains already occupied on either side.
+    """
+    assert which_term in {'n', 'c'}
+
+    other_term = {'n': 'c', 'c': 'n'}[which_term]
+    a_linkage = mod_a.elfin.n_linkage if which_term == 'n' else \
+        mod_a.elfin.c_linkage
+    b_linkage = mod_b.elfin.n_linkage if other_term == 'n' else \
+        mod_b.elfin.c_linkage
+    a_busy, b_busy = set(a_linkage.keys()), set(b_linkage.keys())
+
+    # A single has one chain, so any link occupies the terminus.
+    if mod_a.elfin.module_type == 'single' and a_busy:
+        return []
+    if mod_b.elfin.module_type == 'single' and b_busy:
+        return []
+
+    return [(chain_a, chain_b)
+            for chain_a, chain_b in get_compat_graph().get_links(
+                mod_a.elfin.module_name, which_term, mod_b.elfin.module_name)
+            if chain_a not in a_busy and chain_b not in b_busy]
+
+
 def module_enum_tuple(mod_name,
                       extrude_from=None,
                       extrude_into=None,
@@ -1065,23 +1751,61 @@ def module_enum_tuple(mod_name,
 
 def import_module(mod_name):
     """Links a module object from library.blend. Supports all module types."""
-    lmod = None
+    return import_modules([mod_name])[0]
+
+
+def import_modules(mod_names):
+    """Links one module object per name in mod_names from library.blend,
+    loading all missing prototypes in a single library load.
+    """
+    lmods = []
     try:
-        with bpy.data.libraries.load(addon_paths.modlib_path) as \
-                (data_from, data_to):
-            data_to.objects = [mod_name]
+        PrototypePool().preload(addon_paths.modlib_path, mod_names)
 
-        lmod = bpy.context.scene.objects.link(data_to.objects[0]).object
+        for mod_name in mod_names:
+            lmod = PrototypePool().instantiate(
+                addon_paths.modlib_path, mod_name)
+            lmods.append(lmod)
 
-        lmod.elfin.init_module(lmod, mod_name)
+            lmod.elfin.init_module(lmod, mod_name)
 
-        # Force newly loaded module to not be in selected status
-        lmod.select = False
+            # Force newly loaded module to not be in selected status
+            lmod.select = False
 
-        return lmod
+        return lmods
     except Exception as e:
-        if lmod:
+        for lmod in lmods:
             # In case something went wrong before this line in try
             lmod.elfin.obj_ptr = lmod
             lmod.elfin.destroy()
         raise e
+
+
+def preload_modules(mod_names):
+    """Loads prototypes for mod_names ahead of a series of imports."""
+    PrototypePool().preload(addon_paths.modlib_path, mod_names)
+
+
+def get_prototype_meshes(mod_names=None):
+    """Returns {module name: collision_numpy.MeshArrays} for library modules
+    (all of them by default), for collision checks without scene objects.
+    """
+    if mod_names is None:
+        xdb = get_xdb()
+        mod_names = [name for group in xdb_index.module_groups
+                     for name in xdb['modules'][group]]
+
+    mod_names = sorted(set(mod_names))
+    preload_modules(mod_names)
+    pool = PrototypePool()
+    return {name: collision.get_mesh_arrays(
+            pool.get(addon_paths.modlib_path, name), key=('module', name))
+            for name in mod_names}
+
+
+def save_prototype_meshes(path, mod_names=None):
+    """Writes library module meshes to an .npz file, so that exported designs
+    can be checked by collision_numpy.find_design_collisions() outside
+    Blender.
+    """
+    collision_numpy.save_meshes(path, get_prototype_meshes(mod_names))
@@ -2,16 +2,64 @@ import time
 
 import bpy
 
+from . import collision
+from . import livebuild_helper as helper
+
+
+class TickStats(object):
+    """Running cost of watcher ticks, split by cheap and full checks."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cheap_ticks = 0
+        self.full_ticks = 0
+        self.cheap_ms = 0.0
+        self.full_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def record(self, ms, full):
+        if full:
+            self.full_ticks += 1
+            self.full_ms += ms
+        else:
+            self.cheap_ticks += 1
+            self.cheap_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.last_ms = ms
+
+    def __str__(self):
+        def mean(total, n):
+            return total / n if n else 0.0
+        return ('{} cheap ticks ({:.3f} ms avg), {} full diffs '
+                '({:.3f} ms avg), max {:.3f} ms, last {:.3f} ms').format(
+            self.cheap_ticks, mean(self.cheap_ms, self.cheap_ticks),
+            self.full_ticks, mean(self.full_ms, self.full_ticks),
+            self.max_ms, self.last_ms)
+
 
 class ModuleLifetimeWatcher(object):
     """A watcher that periodically checks entrance and exit of Elfin modules
+
+    Diffing object names costs O(objects), so each check first compares
+    cheap signals: the scene's object count and helper.object_generation,
+    which elfin bumps whenever it creates or deletes objects. The full diff
+    only runs when either changed, or every full_check_interval to catch
+    count-preserving edits made outside elfin (e.g. renames).
     """
     check_interval = 100  # ms
+    full_check_interval = 2000  # ms
 
     def __init__(self):
         self.last_checked = 0
+        self.last_full_check = 0
         self.prev_object_names = set()
+        self.prev_object_count = 0
+        self.prev_generation = helper.object_generation
         self.initialized = False
+        self.tick_stats = TickStats()
 
         # A interval too small can cause lags.
         assert self.check_interval > 50
@@ -27,6 +75,10 @@ class ModuleLifetimeWatcher(object):
         # called)
         if not self.initialized:
             self.prev_object_names = set(bpy.context.scene.objects.keys())
+            self.prev_object_count = len(self.prev_object_names)
+            self.prev_generation = helper.object_generation
+            collision.module_index.rebuild(bpy.context.scene)
+            helper.NetworkIndex().mark_dirty()
             self.initialized = True
             print('{} initialized'.format(__name__))
             return
@@ -36,43 +88,73 @@ class ModuleLifetimeWatcher(object):
         if delta > self.check_interval:
             self.last_checked = now
 
-            now_object_names = set(scene.objects.keys())
-
-            # Even new modules might get immediately deleted due to collision.
-            # However, the deletion at the collision detection operator takes
-            # care of severing linkages and removing from bpy.data.objects.
-            deleted_object_names = self.prev_object_names - now_object_names
-            new_object_names = now_object_names - self.prev_object_names
-            self.prev_object_names = now_object_names
+            object_count = len(scene.objects)
+            generation = helper.object_generation
+            full = object_count != self.prev_object_count or \
+                generation != self.prev_generation or \
+                now - self.last_full_check > self.full_check_interval
 
-            if deleted_object_names:
-                print('All exiting objects: {}'.format(deleted_object_names))
-            for don in deleted_object_names:
-                self.on_module_exit(don)
+            if full:
+                self.last_full_check = now
+                self.prev_object_count = object_count
+                self.prev_generation = generation
+                self.diff_objects(scene)
 
-            if new_object_names:
-                print('All entering objects: {}'.format(new_object_names))
-            for non in new_object_names:
-                self.on_module_enter(non)
+            self.tick_stats.record(time.time() * 1000 - now, full)
 
-    def on_module_enter(self, object_name):
+    def diff_objects(self, scene):
+        """Calls on_module_exit()/on_module_enter() for objects that left or
+        entered the scene since the last diff.
+        """
+        now_object_names = set(scene.objects.keys())
+
+        # Even new modules might get immediately deleted due to collision.
+        # However, the deletion at the collision detection operator takes
+        # care of severing linkages and removing from bpy.data.objects.
+        deleted_object_names = self.prev_object_names - now_object_names
+        new_object_names = now_object_names - self.prev_object_names
+        self.prev_object_names = now_object_names
+
+        # Each batch is dispatched through a single operator call, so that
+        # pasting or deleting many modules costs one scene update.
+        if deleted_object_names:
+            print('All exiting objects: {}'.format(deleted_object_names))
+            self.on_modules_exit(deleted_object_names)
+
+        if new_object_names:
+            print('All entering objects: {}'.format(new_object_names))
+            self.on_modules_enter(new_object_names)
+
+    def on_modules_enter(self, object_names):
         """Entrance conditioned on absence of collision"""
-        try:
-            ob = bpy.data.objects[object_name]
-            # New objects should never generate a KeyError, as opposed to
-            # deleted objects.
-            if ob.elfin.is_module():
+        entered = []
+        for object_name in object_names:
+            # New objects should never be missing, as opposed to deleted
+            # objects.
+            ob = bpy.data.objects.get(object_name)
+            if ob is None:
+                print('Couldn\'t find entering object named',
+                      object_name, ' - probably a network parent?')
+            elif ob.elfin.is_module():
                 print('Module enter: \"{}\"'.format(ob))
-                if not bpy.context.scene.elfin.disable_auto_collision_check:
-                    bpy.ops.elfin.check_collision(object_name=ob.name)
-        except KeyError:
-            print('Couldn\'t find entering object named',
-                  object_name, ' - probably a network parent?')
+                collision.module_index.insert(ob)
+                helper.NetworkIndex().insert(ob)
+                entered.append(ob.name)
+
+        if entered and \
+                not bpy.context.scene.elfin.disable_auto_collision_check:
+            bpy.ops.elfin.check_collision(
+                object_names=[{'name': name} for name in entered])
 
-    def on_module_exit(self, object_name):
-        if object_name in bpy.data.objects:
-            # bpy.data.objects[object_name].elfin.destroy()
-            bpy.ops.elfin.destroy_object(name=object_name)
+    def on_modules_exit(self, object_names):
+        for object_name in object_names:
+            collision.module_index.remove(object_name)
+            helper.NetworkIndex().remove_name(object_name)
 
         # If not existing in bpy.data.objects, then the object is either
         # non-elfin or its destroy() has been called by other elfin objects.
+        remaining = [name for name in object_names
+                     if name in bpy.data.objects]
+        if remaining:
+            bpy.ops.elfin.destroy_object(
+                names=[{'name': name} for name in remaining])
@@ -0,0 +1,247 @@
+import collections
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+# Global (Const) Variables -----------------------
+
+# Pymol (Angstrom) units per Blender unit. Defined here rather than in
+# livebuild_helper so that bpy-free modules can share it.
+blender_pymol_unit_conversion = 10.0
+
+module_groups = ('singles', 'hubs')
+
+# Bump whenever the layout of the cached payload (including the compiled
+# tables) changes, so that stale sidecars are ignored.
+cache_version = 2
+
+# Classes ----------------------------------------
+
+
+class TransformTable(object):
+    """Compiled view of xdb['n_to_c_tx'].
+
+    All transforms are stored once in contiguous float64 arrays of shape
+    (N, 4, 4), where row i corresponds to xdb['n_to_c_tx'][i]:
+     - raw: transforms as found in the xdb (pymol units).
+     - fwd: raw transforms with translation converted to Blender units.
+     - inv: inverse of fwd.
+
+    index maps (mod_a, chain_a, mod_b, chain_b) to the row of the transform
+    that takes mod_b's frame to mod_a's c-terminus.
+    """
+
+    def __init__(self, xdb):
+        tx_list = xdb['n_to_c_tx']
+        n_tx = len(tx_list)
+
+        self.raw = np.zeros((n_tx, 4, 4), dtype=np.float64)
+        if n_tx:
+            self.raw[:, :3, :3] = [tx['rot'] for tx in tx_list]
+            self.raw[:, :3, 3] = [tx['tran'] for tx in tx_list]
+        self.raw[:, 3, 3] = 1.0
+
+        self.fwd = self.raw.copy()
+        self.fwd[:, :3, 3] /= blender_pymol_unit_conversion
+
+        # xdb rotations are orthonormal, so the inverse is just the
+        # transposed rotation and a rotated negative translation.
+        rot_t = self.fwd[:, :3, :3].transpose(0, 2, 1)
+        self.inv = np.zeros_like(self.fwd)
+        self.inv[:, :3, :3] = rot_t
+        self.inv[:, :3, 3] = -np.einsum('nij,nj->ni', rot_t,
+                                        self.fwd[:, :3, 3])
+        self.inv[:, 3, 3] = 1.0
+
+        self.index = {}
+        for group in module_groups:
+            for mod_a, meta_a in xdb['modules'][group].items():
+                for chain_a, chain_meta in meta_a['chains'].items():
+                    for mod_b, b_chains in chain_meta['c'].items():
+                        for chain_b, tx_id in b_chains.items():
+                            self.index[(mod_a, chain_a, mod_b, chain_b)] = \
+                                tx_id
+
+    def __len__(self):
+        return len(self.raw)
+
+    def as_dict(self):
+        return {
+            'raw': self.raw,
+            'fwd': self.fwd,
+            'inv': self.inv,
+            'index': self.index
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores a table from as_dict() output without recompiling."""
+        table = cls.__new__(cls)
+        table.raw = data['raw']
+        table.fwd = data['fwd']
+        table.inv = data['inv']
+        table.index = data['index']
+        return table
+
+    def row(self, mod_a, chain_a, mod_b, chain_b):
+        """Returns the row of an n_to_c_tx. Raises KeyError if the modules
+        are not compatible.
+        """
+        return self.index[(mod_a, chain_a, mod_b, chain_b)]
+
+    def get(self, mod_a, chain_a, mod_b, chain_b, invert=False):
+        """Returns the Blender-scaled (4, 4) transform, or its inverse."""
+        table = self.inv if invert else self.fwd
+        return table[self.row(mod_a, chain_a, mod_b, chain_b)]
+
+
+class CompatibilityGraph(object):
+    """Adjacency index of which module chains can be linked.
+
+    Built once per xdb load so that compatibility questions become dict
+    lookups instead of nested xdb scans:
+     - partners: (mod, chain, term) -> ((mod_b, chain_b), ...), the chains
+       that can be attached to mod's chain at term.
+     - reverse: (mod_b, chain_b, term) -> ((mod, chain), ...), the chains
+       that list (mod_b, chain_b) as a partner at term.
+     - links: (mod_a, term, mod_b) -> ((chain_a, chain_b), ...), every way
+       mod_b can be attached to mod_a's term.
+     - chains: mod -> (chain, ...), in xdb order.
+    """
+
+    def __init__(self, xdb):
+        self.partners = {}
+        self.reverse = {}
+        self.links = {}
+        self.chains = {}
+
+        for group in module_groups:
+            for mod_a, meta_a in xdb['modules'][group].items():
+                self.chains[mod_a] = tuple(meta_a['chains'].keys())
+                for chain_a, chain_meta in meta_a['chains'].items():
+                    for term in ('n', 'c'):
+                        partners = []
+                        for mod_b, b_chains in chain_meta[term].items():
+                            for chain_b in b_chains:
+                                partners.append((mod_b, chain_b))
+                                self.reverse.setdefault(
+                                    (mod_b, chain_b, term), []).append(
+                                    (mod_a, chain_a))
+                                self.links.setdefault(
+                                    (mod_a, term, mod_b), []).append(
+                                    (chain_a, chain_b))
+                        self.partners[(mod_a, chain_a, term)] = \
+                            tuple(partners)
+
+        self.reverse = {k: tuple(v) for k, v in self.reverse.items()}
+        self.links = {k: tuple(v) for k, v in self.links.items()}
+
+    def get_partners(self, mod, chain, term):
+        return self.partners.get((mod, chain, term), ())
+
+    def get_reverse_partners(self, mod_b, chain_b, term):
+        return self.reverse.get((mod_b, chain_b, term), ())
+
+    def get_links(self, mod_a, term, mod_b):
+        return self.links.get((mod_a, term, mod_b), ())
+
+    def get_chains(self, mod):
+        return self.chains.get(mod, ())
+
+    def as_dict(self):
+        return {
+            'partners': self.partners,
+            'reverse': self.reverse,
+            'links': self.links,
+            'chains': self.chains
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores a graph from as_dict() output without rebuilding."""
+        graph = cls.__new__(cls)
+        graph.partners = data['partners']
+        graph.reverse = data['reverse']
+        graph.links = data['links']
+        graph.chains = data['chains']
+        return graph
+
+# Loading ----------------------------------------
+
+
+def load_xdb(xdb_path, cache_path=None):
+    """Loads xdb.json and compiles its tables.
+
+    If cache_path is given, a binary sidecar is read from there when it is
+    still fresh, i.e. it was written by the same cache_version and either the
+    size and mtime or the SHA-1 of xdb_path match. Otherwise the JSON is
+    parsed and the sidecar is rewritten.
+
+    Returns:
+     - (xdb, tx_table, compat_graph, from_cache)
+    """
+    stat = os.stat(xdb_path)
+    cached = read_cache(cache_path) if cache_path else None
+
+    if cached and cached['size'] == stat.st_size and \
+            cached['mtime'] == stat.st_mtime:
+        return cached['xdb'], \
+            TransformTable.from_dict(cached['tx_table']), \
+            CompatibilityGraph.from_dict(cached['compat_graph']), True
+
+    with open(xdb_path, 'rb') as file:
+        raw = file.read()
+    digest = hashlib.sha1(raw).hexdigest()
+
+    if cached and cached['sha1'] == digest:
+        # Touched but unchanged: keep payload, refresh the key.
+        xdb = cached['xdb']
+        tx_table = TransformTable.from_dict(cached['tx_table'])
+        compat_graph = CompatibilityGraph.from_dict(cached['compat_graph'])
+        from_cache = True
+    else:
+        xdb = collections.OrderedDict(json.loads(raw.decode('utf-8')))
+        tx_table = TransformTable(xdb)
+        compat_graph = CompatibilityGraph(xdb)
+        from_cache = False
+
+    if cache_path:
+        write_cache(cache_path, {
+            'version': cache_version,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': digest,
+            'xdb': xdb,
+            'tx_table': tx_table.as_dict(),
+            'compat_graph': compat_graph.as_dict(),
+        })
+
+    return xdb, tx_table, compat_graph, from_cache
+
+
+def read_cache(cache_path):
+    """Returns the sidecar payload, or None if it is missing or unusable."""
+    try:
+        with open(cache_path, 'rb') as file:
+            payload = pickle.load(file)
+        if payload.get('version') == cache_version:
+            return payload
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print('Ignoring unreadable xdb cache {}: {}'.format(cache_path, e))
+    return None
+
+
+def write_cache(cache_path, payload):
+    """Writes the sidecar atomically. Failing to write is not an error."""
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print('Could not write xdb cache {}: {}'.format(cache_path, e))
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The elfin package needs bpy, so the bpy-free modules are tested the way
+# headless tools use them: as top-level modules from elfin/.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'elfin'))
@@ -0,0 +1,73 @@
+import sys
+import types
+
+import numpy as np
+
+import collision_numpy
+
+
+def unit_cube():
+    verts = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1)
+                      for z in (-1, 1)], dtype=np.float64)
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1),
+             (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    return collision_numpy.MeshArrays.from_polygons(
+        verts.ravel(),
+        np.arange(0, 24, 4),
+        np.full(6, 4),
+        np.array(quads).ravel(),
+        scale=(1.0, 1.0, 1.0))
+
+
+def translation(x):
+    tx = np.eye(4)
+    tx[0, 3] = x
+    return tx
+
+
+def test_imports_without_bpy():
+    assert 'bpy' not in sys.modules
+
+
+def test_meshes_overlap():
+    cube = unit_cube()
+    assert collision_numpy.meshes_overlap(
+        cube, translation(0), cube, translation(1.5))
+    assert not collision_numpy.meshes_overlap(
+        cube, translation(0), cube, translation(3))
+
+
+def test_find_collisions_skips_linked():
+    cube = unit_cube()
+    names = ['a', 'b', 'c']
+    transforms = [translation(0), translation(1.5), translation(10)]
+    collisions = collision_numpy.find_collisions(
+        names, [cube] * 3, transforms)
+    assert collisions['a'] == ['b'] and collisions['b'] == ['a']
+    assert not collisions['c']
+
+    linked = {frozenset(('a', 'b'))}
+    collisions = collision_numpy.find_collisions(
+        names, [cube] * 3, transforms, linked)
+    assert not any(collisions.values())
+
+
+def test_save_and_load_meshes(tmp_path):
+    path = str(tmp_path / 'meshes.npz')
+    collision_numpy.save_meshes(path, {'cube': unit_cube()})
+    loaded = collision_numpy.load_meshes(path)
+    assert np.array_equal(loaded['cube'].tris, unit_cube().tris)
+
+
+def test_no_fork_inside_blender_ui(monkeypatch):
+    ui = types.SimpleNamespace(app=types.SimpleNamespace(background=False))
+    monkeypatch.setitem(sys.modules, 'bpy', ui)
+    assert not collision_numpy.can_fork_workers()
+
+    # Serial fallback gives the same result as the pool would
+    cube = unit_cube()
+    transforms = [translation(1.5 * i) for i in range(80)]
+    pairs = [(i, i + 1) for i in range(79)]
+    hits = collision_numpy.test_pairs_parallel(
+        pairs, [cube] * 80, transforms, processes=4)
+    assert sorted(hits) == pairs
@@ -0,0 +1,84 @@
+import math
+import sys
+
+import numpy as np
+
+import kinematics
+import xdb_index
+
+
+def rot_z(angle):
+    c, s = math.cos(angle), math.sin(angle)
+    return [[c, -s, 0], [s, c, 0], [0, 0, 1]]
+
+
+def toy_xdb():
+    """One single module 'A' whose c-terminus takes another 'A'."""
+    return {
+        'modules': {
+            'singles': {
+                'A': {'chains': {'A': {'n': {'A': {'A': 0}},
+                                       'c': {'A': {'A': 0}}}}}
+            },
+            'hubs': {}
+        },
+        'n_to_c_tx': [{'rot': rot_z(0.3), 'tran': [10, 0, 0]}]
+    }
+
+
+def solution(n_nodes, term='C'):
+    return [{'name': 'A', 'rot': np.eye(3).tolist(), 'tran': [0, 0, 0],
+             'src_term': term, 'src_chain_name': 'A',
+             'dst_chain_name': 'A'} for _ in range(n_nodes)]
+
+
+def random_rigid(rng):
+    q, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    tx = np.eye(4)
+    tx[:3, :3] = q
+    tx[:3, 3] = rng.normal(size=3)
+    return tx
+
+
+def test_imports_without_bpy():
+    assert 'bpy' not in sys.modules
+
+
+def test_chain_transforms_matches_sequential_product():
+    rng = np.random.default_rng(0)
+    for n in (0, 1, 2, 3, 8, 33):
+        relative = np.array([random_rigid(rng) for _ in range(n)])
+        frames = np.array([random_rigid(rng) for _ in range(n)])
+        base = random_rigid(rng)
+
+        expected = []
+        pose = base
+        for rel, frame in zip(relative, frames):
+            pose = pose.dot(rel).dot(frame)
+            expected.append(pose)
+
+        poses = kinematics.chain_transforms(relative, base, frames)
+        assert poses.shape == (n, 4, 4)
+        assert np.allclose(poses, np.reshape(expected, (n, 4, 4)))
+
+
+def test_chain_transforms_without_steps():
+    poses = kinematics.chain_transforms(np.zeros((0, 4, 4)), np.eye(4), [])
+    assert poses.shape == (0, 4, 4)
+
+
+def test_solution_transforms():
+    xdb = toy_xdb()
+    tx_table = xdb_index.TransformTable(xdb)
+
+    poses = kinematics.solution_transforms(solution(3), xdb, tx_table)
+    assert poses.shape == (3, 4, 4)
+    assert np.allclose(poses[1], tx_table.fwd[0])
+    assert np.allclose(poses[2], tx_table.fwd[0].dot(tx_table.fwd[0]))
+
+    # Extruding from the n-terminus walks the same transforms backwards
+    poses_n = kinematics.solution_transforms(solution(3, 'N'), xdb)
+    assert np.allclose(poses_n[2], np.linalg.inv(poses[2]))
+
+    assert kinematics.solution_transforms(solution(1), xdb).shape == \
+        (1, 4, 4)